@@ -0,0 +1,113 @@
+"""
+记忆压缩收益评估：在长会话上比较开启/关闭记忆压缩时，规划器完成目标所需的迭代次数
+
+The planner is simulated: every tool call returns one fact buried in a long
+result, and a fact counts as known only if it survives in the truncated
+planning prompt. Facts lost to truncation are looked up again, which costs
+iterations. No LLM or tokenizer download is needed.
+"""
+import argparse
+import json
+import random
+
+from kwaiagents.agents.memory import MemoryBuilder
+from kwaiagents.agents.prompts import prompt_truncate
+from kwaiagents.utils.nlp_utils import extractive_summary
+
+
+CITIES = ["Paris", "Tokyo", "Nairobi", "Lima", "Oslo", "Hanoi", "Cairo", "Quito", "Perth", "Dublin",
+    "Seoul", "Lagos", "Vienna", "Havana", "Dhaka", "Riga"]
+FILLER = [
+    "The weather was mild and many visitors walked along the river.",
+    "Several museums extended their opening hours during the festival.",
+    "Local markets sell fresh produce every morning except holidays.",
+    "Public transport includes buses, trams and a small metro network.",
+    "Historic buildings in the old town were restored over the last decade.",
+    "Restaurants serve both traditional dishes and international cuisine.",
+]
+
+
+class ChunkTokenizer(object):
+    """Stands in for a BPE tokenizer, about 4 characters per token"""
+    def __init__(self, chunk_size=4):
+        self.chunk_size = chunk_size
+        self.vocab = dict()
+        self.pieces = list()
+
+    def encode(self, text, add_special_tokens=False):
+        tokens = list()
+        for i in range(0, len(text), self.chunk_size):
+            piece = text[i:i + self.chunk_size]
+            if piece not in self.vocab:
+                self.vocab[piece] = len(self.pieces)
+                self.pieces.append(piece)
+            tokens.append(self.vocab[piece])
+        return tokens
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return "".join(self.pieces[t] for t in tokens)
+
+
+def make_result(fact, result_length, rng):
+    sentences = [rng.choice(FILLER) for _ in range(result_length // 60)]
+    sentences.insert(len(sentences) // 2, fact)
+    return " ".join(sentences)
+
+
+def run_session(facts, result_length, max_tokens_num, compaction, token_budget, max_iter_num, seed=0):
+    rng = random.Random(seed)
+    tokenizer = ChunkTokenizer()
+    goal = "Find the population of " + ", ".join(city for city, _ in facts)
+    builder = MemoryBuilder(
+        tokenizer=tokenizer,
+        token_budget=token_budget if compaction else 0,
+        keep_recent_tasks=2,
+        summarize=lambda task, goal: extractive_summary(task["result"], goal + " " + task["task_name"], 200))
+    complete_task_list = list()
+    calls = dict()
+    for iter_id in range(1, max_iter_num + 1):
+        memory = builder.build(list(), complete_task_list, goal)
+        prompt = prompt_truncate(tokenizer, f"GOAL:{goal}\n{memory}\nA new Task:", memory, max_tokens_num)
+        unknown = [(city, value) for city, value in facts if f"The population of {city} is {value}." not in prompt]
+        if not unknown:
+            return iter_id, calls
+        city, value = unknown[0]
+        calls[city] = calls.get(city, 0) + 1
+        complete_task_list.append({
+            "task_id": len(complete_task_list) + 1,
+            "task_name": f"population of {city}",
+            "command": {"name": "web_search", "args": {"text": f"population of {city}"}},
+            "result": make_result(f"The population of {city} is {value}.", result_length, rng)
+        })
+    return None, calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_facts", type=int, nargs="+", default=[4, 8, 12, 16], help="Facts to look up per session")
+    parser.add_argument("--result_length", type=int, default=1500, help="Characters of every tool result")
+    parser.add_argument("--max_tokens_num", type=int, default=4096, help="Maximum length of the planning prompt")
+    parser.add_argument("--memory_token_budget", type=int, default=None, help="Memory budget of the compaction, half of max_tokens_num by default")
+    parser.add_argument("--max_iter_num", type=int, default=64, help="Iterations before a session gives up")
+    args = parser.parse_args()
+
+    for num_facts in args.num_facts:
+        facts = [(CITIES[i % len(CITIES)] + (str(i // len(CITIES)) if i >= len(CITIES) else ""), 1000 + 37 * i)
+            for i in range(num_facts)]
+        row = {"num_facts": num_facts}
+        for compaction in [False, True]:
+            iters, calls = run_session(facts, args.result_length, args.max_tokens_num, compaction,
+                args.memory_token_budget or args.max_tokens_num // 2, args.max_iter_num)
+            key = "compaction" if compaction else "truncation"
+            row[f"{key}_iterations"] = iters if iters is not None else f">{args.max_iter_num}"
+            row[f"{key}_repeated_calls"] = sum(calls.values()) - len(calls)
+        if isinstance(row["compaction_iterations"], int):
+            if isinstance(row["truncation_iterations"], int):
+                row["iterations_saved"] = row["truncation_iterations"] - row["compaction_iterations"]
+            else:
+                row["iterations_saved"] = f">{args.max_iter_num - row['compaction_iterations']}"
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+前缀缓存收益评估：比较两种提示词布局下，相邻两次任务规划提示词共享的前缀 token 数
+
+Two consecutive planning prompts of one session are built, the second one
+`--interval` seconds later and with one more complete task in memory. The
+report gives the leading tokens both prompts share, i.e. what a server-side
+prefix cache (e.g. vLLM automatic prefix caching) can reuse, for the default
+and the `prefix_cache` layout. No LLM or tokenizer download is needed.
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+
+from kwaiagents.agents import AgentProfile
+from kwaiagents.agents.memory import MemoryBuilder
+from kwaiagents.agents.prompts import make_planning_prompt, count_shared_prefix_tokens
+from kwaiagents.tools import TOOLS
+import kwaiagents.utils.date_utils as date_utils
+
+from memory_compaction_benchmark import ChunkTokenizer
+
+
+class SimulatedClock(datetime):
+    """The `datetime` of the prompt time, moved forward by the benchmark instead of the wall clock"""
+    current = datetime(2024, 3, 1, 10, 0, 0, 123456)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+def make_task(task_id):
+    return {
+        "task_id": task_id,
+        "task_name": f"search step {task_id}",
+        "command": {"name": "web_search", "args": {"text": f"query {task_id}"}},
+        "result": f"Result {task_id}: " + "Some text found on the web. " * 40
+    }
+
+
+def measure(prompt_layout, lang, num_tasks, interval, time_quantum, max_tokens_num):
+    tokenizer = ChunkTokenizer()
+    agent_profile = AgentProfile({"lang": lang, "max_iter_num": num_tasks + 2})
+    tools = TOOLS.resolve(agent_profile.tools)
+    goal = "Compare the weather of Paris and Tokyo this week"
+    complete_task_list = [make_task(i + 1) for i in range(num_tasks)]
+    builder = MemoryBuilder(tokenizer=tokenizer)
+    quantum = time_quantum if prompt_layout == "prefix_cache" else None
+
+    SimulatedClock.current = datetime(2024, 3, 1, 10, 0, 0, 123456)
+    prompts = list()
+    for _ in range(2):
+        memory = builder.build(list(), complete_task_list, goal)
+        prompts.append(make_planning_prompt(agent_profile, goal, tools, memory, max_tokens_num, tokenizer,
+            lang=lang, prompt_layout=prompt_layout, time_quantum=quantum))
+        complete_task_list = complete_task_list + [make_task(len(complete_task_list) + 1)]
+        SimulatedClock.current += timedelta(seconds=interval)
+
+    shared = count_shared_prefix_tokens(tokenizer, prompts[0], prompts[1])
+    total = len(tokenizer.encode(prompts[1], add_special_tokens=False))
+    return shared, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lang", type=str, default="en", choices=["en", "zh"], help="The language of the prompts")
+    parser.add_argument("--num_tasks", type=int, nargs="+", default=[0, 2, 4], help="Complete tasks before the first planning call")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between the two planning calls")
+    parser.add_argument("--time_quantum", type=int, default=60, help="Time quantum of the prefix_cache layout")
+    parser.add_argument("--max_tokens_num", type=int, default=4096, help="Maximum length of the planning prompt")
+    args = parser.parse_args()
+
+    date_utils.datetime = SimulatedClock
+    for num_tasks in args.num_tasks:
+        row = {"num_tasks": num_tasks}
+        for prompt_layout in ["default", "prefix_cache"]:
+            shared, total = measure(prompt_layout, args.lang, num_tasks, args.interval,
+                args.time_quantum, args.max_tokens_num)
+            row[f"{prompt_layout}_shared_tokens"] = shared
+            row[f"{prompt_layout}_prompt_tokens"] = total
+            row[f"{prompt_layout}_shared_ratio"] = round(shared / total, 4) if total else 0.0
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import requests
 from gtrending import fetch_repos
 from kwaiagents.tools.base import BaseTool, BaseResult
 from kwaiagents.agents import AgentProfile, KAgentSysLite
-from kwaiagents.config import Config, CFG
+from kwaiagents.config import Config
 
 
 class GithubTrendingResults(BaseResult):
@@ -72,9 +72,9 @@ if __name__ == "__main__":
     cfg.fast_llm_model = llm_name
     cfg.smart_llm_model = llm_name
 
-    CFG.local_llm_host = "localhost"
-    CFG.local_llm_port = 8888
-    CFG.use_local_llm = True
+    cfg.local_llm_host = "localhost"
+    cfg.local_llm_port = 8888
+    cfg.use_local_llm = True
 
     agent = KAgentSysLite(
             cfg=cfg,
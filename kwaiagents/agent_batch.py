@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from kwaiagents.config import CFG
+from kwaiagents.agent_start import make_base_config
+from kwaiagents.agent_server import AgentWorkerPool
+from kwaiagents.llms import get_tokenizer
+
+
+def load_completed_ids(output_path):
+    """Ids already answered in `output_path`, failed sessions are not counted so they run again"""
+    completed_ids = set()
+    if not os.path.exists(output_path):
+        return completed_ids
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # the last line of a crashed run may be cut off
+                continue
+            if result.get("response") != "error":
+                completed_ids.add(str(result.get("id")))
+    return completed_ids
+
+
+def iter_input_dicts(input_path):
+    with open(input_path, "r") as f:
+        for line_id, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                input_dict = json.loads(line)
+            except ValueError:
+                print(f"skip invalid json at line {line_id + 1} of {input_path}", file=sys.stderr)
+                continue
+            # ids must be stable across runs to resume
+            input_dict["id"] = str(input_dict.get("id", f"line-{line_id + 1}"))
+            # lines are independent queries, not turns of a stored session
+            input_dict.setdefault("history", list())
+            yield input_dict
+
+
+def open_output(output_path):
+    f = open(output_path, "a")
+    if f.tell() > 0:
+        with open(output_path, "rb") as rf:
+            rf.seek(-1, os.SEEK_END)
+            if rf.read(1) != b"\n":
+                f.write("\n")
+    return f
+
+
+def run_batch(input_path, output_path, concurrency=4, defaults=None, base_cfg=None):
+    """Run every `AgentService.chat` input_dict of a JSONL file and append the results to `output_path`.
+
+    Results are written as sessions finish, so their order differs from the
+    input. Records whose id already has a successful result in `output_path`
+    are skipped, rerunning after a crash picks up where it stopped; when an id
+    appears more than once the last line wins.
+
+    Returns:
+        dict: Counts, elapsed seconds, throughput and latency percentiles.
+    """
+    completed_ids = load_completed_ids(output_path)
+    # records are independent single-turn sessions, their `line-N` ids must not
+    # read or overwrite the conversations stored by the server
+    base_cfg = (base_cfg if base_cfg else CFG).copy()
+    base_cfg.session_store = ""
+    # at most `concurrency` sessions running and as many waiting, the input is read as they finish
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    pool = AgentWorkerPool(max_workers=concurrency, max_queue_size=concurrency * 2, defaults=defaults, base_cfg=base_cfg)
+    write_lock = threading.Lock()
+    skipped = 0
+    start_time = time.time()
+
+    with open_output(output_path) as f:
+        def write(future):
+            try:
+                result = future.result()
+                with write_lock:
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    f.flush()
+            finally:
+                slots.release()
+
+        for input_dict in iter_input_dicts(input_path):
+            if input_dict["id"] in completed_ids:
+                skipped += 1
+                continue
+            slots.acquire()
+            pool.submit(input_dict).add_done_callback(write)
+        pool.shutdown()
+
+    elapsed = time.time() - start_time
+    stats = pool.get_stats()
+    report = {
+        "completed": stats["completed"],
+        "failed": stats["failed"],
+        "skipped": skipped,
+        "elapsed": round(elapsed, 3),
+        "sessions_per_second": round(stats["submitted"] / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency": stats["latency"]
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--input", type=str, required=True, help="JSONL file of input dicts, one query per line")
+    parser.add_argument("--output", type=str, required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of concurrent sessions")
+    parser.add_argument("--llm_name", type=str, default="gpt-3.5-turbo", help="Default llm of a query")
+    parser.add_argument("--use_local_llm", default=False, action='store_true', help="Whether to use local llm")
+    parser.add_argument("--local_llm_host", type=str, default="localhost", help="The host of local llm service")
+    parser.add_argument("--local_llm_port", type=int, default="8888", help="The port of local llm service")
+    parser.add_argument("--tool_names", type=str, default='["auto"]', help="Default tools of a query")
+    parser.add_argument("--max_iter_num", type=int, default=1, help="Default number of iteration of agents")
+    parser.add_argument("--lang", type=str, default="en", choices=["en", "zh"], help="Default language of a query")
+
+    args = parser.parse_args()
+
+    base_cfg = make_base_config(args)
+
+    try:
+        get_tokenizer(args.llm_name, base_cfg)
+    except:
+        print(traceback.format_exc(), file=sys.stderr)
+
+    report = run_batch(args.input, args.output, args.concurrency, defaults={
+        "llm_name": args.llm_name,
+        "tool_names": args.tool_names,
+        "max_iter_num": args.max_iter_num,
+        "lang": args.lang
+    }, base_cfg=base_cfg)
+    print(json.dumps({"event": "batch_report", **report}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from kwaiagents.agent_start import AgentService, make_base_config
+from kwaiagents.llms import get_tokenizer
+from kwaiagents.utils.metrics import LatencyRecorder
+
+
+class ServerBusyError(Exception):
+    pass
+
+
+class AgentWorkerPool(object):
+    """Runs `AgentService.chat` sessions on a bounded pool of worker threads.
+
+    At most `max_workers` sessions run at once and at most `max_queue_size`
+    wait for a worker, further submissions raise `ServerBusyError`. Queue wait
+    and end-to-end latency percentiles are kept for `get_stats`.
+    """
+    def __init__(self, max_workers=4, max_queue_size=64, defaults=None, base_cfg=None):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.defaults = defaults if defaults else dict()
+        self.base_cfg = base_cfg
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-worker")
+        self.queue_latency = LatencyRecorder()
+        self.latency = LatencyRecorder()
+        self.queued = 0
+        self.running = 0
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def submit(self, input_dict):
+        """Queue a session, returns a future of the `AgentService.chat` result"""
+        with self._lock:
+            if self.queued >= self.max_queue_size:
+                self.stats["rejected"] += 1
+                raise ServerBusyError(f"{self.queued} sessions are already waiting")
+            self.queued += 1
+            self.stats["submitted"] += 1
+        input_dict = dict(self.defaults, **input_dict)
+        input_dict.setdefault("id", uuid.uuid1().hex)
+        return self.executor.submit(self._run, input_dict, time.time())
+
+    def _run(self, input_dict, submit_time):
+        start_time = time.time()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        self.queue_latency.record(start_time - submit_time)
+        try:
+            # AgentService keeps the config of its current request, one per session
+            result = AgentService(base_cfg=self.base_cfg).chat(input_dict)
+        except:
+            print(traceback.format_exc())
+            result = {"id": str(input_dict.get("id", "")), "response": "error"}
+        with self._lock:
+            self.running -= 1
+            self.stats["completed" if result.get("response") != "error" else "failed"] += 1
+        self.latency.record(time.time() - submit_time)
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["queue_depth"] = self.queued
+            stats["running"] = self.running
+        stats["max_workers"] = self.max_workers
+        stats["queue_latency"] = self.queue_latency.summary()
+        stats["latency"] = self.latency.summary()
+        return stats
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """POST /chat takes an `AgentService.chat` input_dict, GET /stats reports the worker pool"""
+    pool = None
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.pool.get_stats())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/chat":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            input_dict = json.loads(self.rfile.read(length))
+            if "query" not in input_dict:
+                raise ValueError("query is required")
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        try:
+            future = self.pool.submit(input_dict)
+        except ServerBusyError as e:
+            self.send_json(503, {"error": str(e)})
+            return
+        self.send_json(200, future.result())
+
+    def log_message(self, format, *args):
+        sys.stderr.write("%s - %s\n" % (self.address_string(), format % args))
+
+
+def serve_http(pool, host="localhost", port=8080):
+    handler = type("BoundAgentRequestHandler", (AgentRequestHandler,), {"pool": pool})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"agent server listening on http://{host}:{port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+
+
+def serve_jsonl(pool, input_stream=sys.stdin, output_stream=sys.stdout):
+    """Read one input_dict per line and write one result per line, in completion order.
+
+    The agents log to sys.stdout, so it is pointed at stderr while serving to
+    keep `output_stream` clean. A line `{"command": "stats"}` writes the pool stats.
+    Lines are read only while the pool has room for another session, the
+    pipe then holds back the writer instead of requests being rejected.
+    """
+    write_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(pool.max_workers + pool.max_queue_size)
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    def write(data):
+        with write_lock:
+            output_stream.write(json.dumps(data, ensure_ascii=False) + "\n")
+            output_stream.flush()
+
+    def done(future):
+        try:
+            write(future.result())
+        finally:
+            slots.release()
+
+    try:
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                input_dict = json.loads(line)
+            except ValueError as e:
+                write({"response": "error", "error": str(e)})
+                continue
+            if input_dict.get("command") == "stats":
+                write({"stats": pool.get_stats()})
+                continue
+            slots.acquire()
+            try:
+                future = pool.submit(input_dict)
+            except ServerBusyError as e:
+                slots.release()
+                write({"id": str(input_dict.get("id", "")), "response": "error", "error": str(e)})
+                continue
+            future.add_done_callback(done)
+        # results are written by the workers, wait for them before the final stats
+        pool.shutdown()
+        write({"stats": pool.get_stats()})
+    finally:
+        pool.shutdown()
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--mode", type=str, default="http", choices=["http", "jsonl"], help="Serve over http or json lines on stdin/stdout")
+    parser.add_argument("--host", type=str, default="localhost", help="The host of the http server")
+    parser.add_argument("--port", type=int, default=8080, help="The port of the http server")
+    parser.add_argument("--max_workers", type=int, default=4, help="Maximum number of concurrent sessions")
+    parser.add_argument("--max_queue_size", type=int, default=64, help="Maximum number of sessions waiting for a worker")
+    parser.add_argument("--llm_name", type=str, default="gpt-3.5-turbo", help="Default llm of a request")
+    parser.add_argument("--use_local_llm", default=False, action='store_true', help="Whether to use local llm")
+    parser.add_argument("--local_llm_host", type=str, default="localhost", help="The host of local llm service")
+    parser.add_argument("--local_llm_port", type=int, default="8888", help="The port of local llm service")
+    parser.add_argument("--tool_names", type=str, default='["auto"]', help="Default tools of a request")
+    parser.add_argument("--max_iter_num", type=int, default=1, help="Default number of iteration of agents")
+    parser.add_argument("--lang", type=str, default="en", choices=["en", "zh"], help="Default language of a request")
+    parser.add_argument("--session_store", type=str, default="sqlite", choices=["sqlite", "memory", ""], help="Where conversations are kept between requests, empty to keep none")
+
+    args = parser.parse_args()
+
+    base_cfg = make_base_config(args)
+    base_cfg.session_store = args.session_store
+
+    # load the tokenizer of the default llm before the first request needs it
+    try:
+        get_tokenizer(args.llm_name, base_cfg)
+    except:
+        print(traceback.format_exc(), file=sys.stderr)
+
+    pool = AgentWorkerPool(
+        max_workers=args.max_workers,
+        max_queue_size=args.max_queue_size,
+        base_cfg=base_cfg,
+        defaults={
+            "llm_name": args.llm_name,
+            "tool_names": args.tool_names,
+            "max_iter_num": args.max_iter_num,
+            "lang": args.lang
+        })
+
+    if args.mode == "http":
+        serve_http(pool, args.host, args.port)
+    else:
+        serve_jsonl(pool)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import argparse
+from contextlib import nullcontext
 from datetime import datetime
 import json
 import os
@@ -7,22 +8,32 @@ import time
 import traceback
 from kwaiagents.config import Config, CFG
 from kwaiagents.agents import KAgentSysLite, AgentProfile
+from kwaiagents.agents.session_store import get_session_store, SESSION_LOCKS
 
 
 class AgentService(object):
-    def __init__(self, *args, **kwargs):
-        self.cfg = Config()
+    def __init__(self, base_cfg=None, *args, **kwargs):
+        # settings shared by all requests, e.g. the llm backend, each request works on a copy
+        self.base_cfg = base_cfg if base_cfg else CFG
+        self.cfg = self.base_cfg.copy()
         self.agent_profile = None
         self.p_date = datetime.today().strftime('%Y%m%d')
 
     @staticmethod
-    def parse_config(input_dict):
-        cfg = Config()
+    def parse_config(input_dict, base_cfg=CFG):
+        cfg = base_cfg.copy()
 
         llm_name = input_dict.get("llm_name", "").lower()
         cfg.fast_llm_model = llm_name
         cfg.smart_llm_model = llm_name
         cfg.max_tokens_num = input_dict.get("max_tokens_num", 4096)
+        cfg.multi_task_planning = input_dict.get("multi_task_planning", cfg.multi_task_planning)
+        cfg.duplicate_command_policy = input_dict.get("duplicate_command_policy", cfg.duplicate_command_policy)
+        cfg.browse_prefetch = input_dict.get("browse_prefetch", cfg.browse_prefetch)
+        cfg.memory_compaction = input_dict.get("memory_compaction", cfg.memory_compaction)
+        for key in ["session_timeout", "session_max_tokens", "session_max_tool_calls", "session_max_browse_pages"]:
+            if input_dict.get(key) is not None:
+                setattr(cfg, key, input_dict[key])
         if llm_name == "gpt-4":
             cfg.fast_llm_model = "gpt-3.5-turbo"
 
@@ -37,6 +48,14 @@ class AgentService(object):
             history = json.loads(history)
         return history
 
+    @staticmethod
+    def load_session(input_dict, session_store):
+        """The history sent by the client, or the stored one when the request carries no history"""
+        if input_dict.get("history") is not None or session_store is None:
+            return AgentService.load_history(input_dict)
+        session = session_store.get(input_dict["id"])
+        return session["history"] if session else list()
+
     def chat(self, input_dict):
         s = "============ INPUT_DICT ============\n"
         for key, val in input_dict.items():
@@ -44,51 +63,72 @@ class AgentService(object):
         print(s)
 
         chat_id = str(input_dict["id"])
-        history = self.load_history(input_dict)
-        self.cfg = self.parse_config(input_dict)
-        self.agent_profile = AgentProfile(input_dict)
-
-        print(self.cfg)
-        print(self.agent_profile)
-
-        try:
-            agent = KAgentSysLite(
-                    cfg=self.cfg,
-                    session_id=chat_id,
-                    agent_profile=self.agent_profile,
-                    lang=input_dict.get("lang", "en"))
-
-            print("\033[95m\033[1m" + "\n***** Question *****" + "\033[0m\033[0m")
-            print(input_dict["query"])
-
-            agent_results = agent.chat(
-                input_dict["query"], 
-                history=history)
-
-            print("\033[95m\033[1m" + "\n***** Response *****" + "\033[0m\033[0m")
-            print(agent_results["response"])
-
-            result = {
-                "id": chat_id,
-                "response": agent_results["response"],
-                "history": json.dumps(agent_results["history"], ensure_ascii=False),
-                "chain_msg": agent_results["chain_msg"],
-                "chain_msg_str": agent_results["chain_msg_str"],
-                "more_info": agent_results["more_info"]
-            }
-
-        except KeyboardInterrupt:
-            exit()
-        except:
-            print(traceback.format_exc())
-            result = {
-                "id": chat_id,
-                "response": "error"
-            }
+        self.cfg = self.parse_config(input_dict, self.base_cfg)
+        session_store = get_session_store(self.cfg)
+        # the turns of one session run one after the other, each on the history stored by the previous one
+        session_lock = SESSION_LOCKS.hold(chat_id) if session_store is not None else nullcontext()
+        with session_lock:
+            history = self.load_session(input_dict, session_store)
+            self.agent_profile = AgentProfile(input_dict)
+
+            print(self.cfg)
+            print(self.agent_profile)
+
+            try:
+                agent = KAgentSysLite(
+                        cfg=self.cfg,
+                        session_id=chat_id,
+                        agent_profile=self.agent_profile,
+                        lang=input_dict.get("lang", "en"))
+
+                print("\033[95m\033[1m" + "\n***** Question *****" + "\033[0m\033[0m")
+                print(input_dict["query"])
+
+                agent_results = agent.chat(
+                    input_dict["query"], 
+                    history=history)
+
+                print("\033[95m\033[1m" + "\n***** Response *****" + "\033[0m\033[0m")
+                print(agent_results["response"])
+                print(json.dumps({
+                    "event": "llm_usage",
+                    "id": chat_id,
+                    "usage": agent_results["more_info"].get("usage", {})
+                }, ensure_ascii=False))
+
+                if session_store is not None:
+                    session_store.put(chat_id, {"history": agent_results["history"]})
+
+                result = {
+                    "id": chat_id,
+                    "response": agent_results["response"],
+                    "more_info": agent_results["more_info"]
+                }
+                if not input_dict.get("slim_response", False):
+                    result["history"] = json.dumps(agent_results["history"], ensure_ascii=False)
+                    result["chain_msg"] = agent_results["chain_msg"]
+                    result["chain_msg_str"] = agent_results["chain_msg_str"]
+
+            except KeyboardInterrupt:
+                exit()
+            except:
+                print(traceback.format_exc())
+                result = {
+                    "id": chat_id,
+                    "response": "error"
+                }
 
         return result
 
 
+def make_base_config(args):
+    cfg = Config()
+    cfg.local_llm_host = args.local_llm_host
+    cfg.local_llm_port = args.local_llm_port
+    cfg.use_local_llm = args.use_local_llm
+    return cfg
+
+
 def main():
     parser = argparse.ArgumentParser()
 
@@ -108,14 +148,17 @@ def main():
     parser.add_argument("--external_knowledge", type=str, default="", help="The link of external knowledge")
     parser.add_argument("--lang", type=str, default="en", choices=["en", "zh"], help="The language of the overall system")
     parser.add_argument("--max_tokens_num", type=int, default=4096, help="Maximum length of model input")
+    parser.add_argument("--session_timeout", type=float, default=None, help="Seconds before the agent stops working and concludes")
+    parser.add_argument("--session_max_tokens", type=int, default=None, help="LLM tokens the agent may spend before concluding")
+    parser.add_argument("--session_max_tool_calls", type=int, default=None, help="Tool calls the agent may make before concluding")
+    parser.add_argument("--session_max_browse_pages", type=int, default=None, help="Web pages the agent may browse")
+    parser.add_argument("--browse_prefetch", default=False, action='store_true', help="Whether to load the top search result pages in the background")
+    parser.add_argument("--memory_compaction", default=False, action='store_true', help="Whether to summarize old task results once the memory exceeds its token budget")
+    parser.add_argument("--multi_task_planning", default=False, action='store_true', help="Whether to plan several tasks at once and run independent ones in parallel")
 
     args = parser.parse_args()
 
-    CFG.local_llm_host = args.local_llm_host
-    CFG.local_llm_port = args.local_llm_port
-    CFG.use_local_llm = args.use_local_llm
-
-    agent_service = AgentService()
+    agent_service = AgentService(base_cfg=make_base_config(args))
 
     agent_service.chat(vars(args))
 
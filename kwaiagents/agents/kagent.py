@@ -1,4 +1,6 @@
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import json
 import logging
 import re
@@ -9,15 +11,20 @@ from typing import Dict, List
 import uuid
 from datetime import datetime
 from lunar_python import Lunar, Solar
-from transformers import AutoTokenizer
 
-from kwaiagents.tools import ALL_NO_TOOLS, ALL_TOOLS, FinishTool, NoTool
-from kwaiagents.llms import create_chat_completion
-from kwaiagents.agents.prompts import make_planning_prompt
+from kwaiagents.config import session_config
+from kwaiagents.tools import TOOLS, FinishTool, NoTool, get_tool_cache_stats
+from kwaiagents.tools import BrowserTool, SearchResult, get_page_prefetcher, get_page_prefetch_stats, prefetch_pages
+from kwaiagents.tools.base import make_tool_call_key
+from kwaiagents.llms import create_chat_completion, get_tokenizer, UsageTracker
+from kwaiagents.agents.memory import MemoryBuilder
+from kwaiagents.agents.prompts import make_planning_prompt, make_memory_summary_prompt, make_duplicate_command_note
 from kwaiagents.agents.prompts import make_no_task_conclusion_prompt, make_task_conclusion_prompt
 from kwaiagents.utils.chain_logger import *
-from kwaiagents.utils.json_fix_general import find_json_dict, correct_json
+from kwaiagents.utils.json_fix_general import find_json_dict, find_json_list, correct_json
 from kwaiagents.utils.date_utils import get_current_time_and_date
+from kwaiagents.utils.nlp_utils import extractive_summary
+from kwaiagents.utils.budget import SessionBudget
 
 
 class SingleTaskListStorage:
@@ -53,9 +60,55 @@ class SingleTaskListStorage:
         self.task_id_counter = 0
 
 
+class TaskGraphStorage(SingleTaskListStorage):
+    """Pending tasks together with the dependencies between them.
+
+    `pop_ready` returns every task whose dependencies are complete, these can
+    run concurrently. Tasks are kept in task id order so that results merge
+    back deterministically.
+    """
+    def __init__(self):
+        super().__init__()
+        self.dependencies = dict()
+        self.done_task_ids = set()
+
+    def add_tasks(self, tasks: List[Dict]):
+        """Assign task ids to newly planned tasks and map the ids of their dependencies"""
+        id_map = dict()
+        for task in tasks:
+            local_id = task.get("task_id")
+            task["task_id"] = self.next_task_id()
+            if local_id is not None:
+                id_map[str(local_id)] = task["task_id"]
+        for task in tasks:
+            if "dependencies" in task:
+                deps = task["dependencies"] if isinstance(task["dependencies"], list) else [task["dependencies"]]
+                task["dependencies"] = [id_map[str(d)] for d in deps if str(d) in id_map and id_map[str(d)] != task["task_id"]]
+                self.dependencies[task["task_id"]] = list(task["dependencies"])
+            self.append(task)
+
+    def pop_ready(self):
+        ready = [t for t in self.tasks if all(d in self.done_task_ids for d in self.dependencies.get(t["task_id"], []))]
+        if not ready:
+            # a dependency cycle, run what is left in order instead of waiting forever
+            ready = list(self.tasks)
+        ready_ids = set(t["task_id"] for t in ready)
+        self.tasks = deque([t for t in self.tasks if t["task_id"] not in ready_ids])
+        return sorted(ready, key=lambda t: t["task_id"])
+
+    def mark_done(self, task: Dict):
+        self.done_task_ids.add(task["task_id"])
+
+    def clear(self):
+        super().clear()
+        self.dependencies = dict()
+        self.done_task_ids = set()
+
+
 class KAgentSysLite(object):
     def __init__(self, cfg, session_id=None, agent_profile=None, tools=None, lang="en"):
-        self.cfg = cfg
+        # the logger, usage tracker and budget of the session go on its own copy of the config
+        self.cfg = cfg.copy()
         self.agent_profile = agent_profile
         self.lang = lang
         self.max_task_num = agent_profile.max_iter_num
@@ -63,84 +116,113 @@ class KAgentSysLite(object):
         self.tokenizer = self.initialize_tokenizer(self.cfg.fast_llm_model)
 
         self.initialize_logger()
+        self.initialize_budget()
         self.initialize_memory()
         self.tool_retrival(tools)
 
     def initialize_logger(self):
         self.chain_logger = ChainMessageLogger(output_streams=[sys.stdout], lang=self.lang)
         self.cfg.set_chain_logger(self.chain_logger)
+        self.usage_tracker = UsageTracker(self.session_id)
+        self.cfg.set_usage_tracker(self.usage_tracker)
+
+    def initialize_budget(self):
+        self.budget = SessionBudget.from_config(self.cfg)
+        self.cfg.set_session_budget(self.budget)
+
+    def within_budget(self):
+        if self.budget.exhausted() is None:
+            return True
+        self.chain_logger.put("finish", logging_budget_exceeded_msg(self.lang))
+        return False
 
     def initialize_memory(self):
-        pass
+        self.memory_builder = MemoryBuilder(
+            tokenizer=self.tokenizer,
+            token_budget=self.memory_token_budget if self.cfg.memory_compaction else 0,
+            keep_recent_tasks=self.cfg.memory_keep_recent_tasks,
+            summarize=self.summarize_task_result)
+
+    @property
+    def memory_token_budget(self):
+        if self.cfg.memory_token_budget:
+            return self.cfg.memory_token_budget
+        return self.cfg.max_tokens_num // 2
+
+    def summarize_task_result(self, task, goal):
+        """A short summary of the result of a complete task, made with the fast llm or extractively"""
+        result = str(task.get("result", ""))
+        if self.cfg.memory_summary_method == "llm":
+            try:
+                prompt = make_memory_summary_prompt(goal, task, self.cfg.memory_summary_max_length, self.lang)
+                summary, _ = create_chat_completion(
+                    query=prompt, llm_model_name=self.cfg.fast_llm_model, session_id=self.session_id,
+                    usage_tracker=self.usage_tracker, stage="memory_compaction", generation_profile="memory_summary",
+                    budget=self.budget)
+                self.chain_logger.put_prompt_response(
+                    prompt=prompt,
+                    response=summary,
+                    session_id=self.session_id,
+                    mtype="memory_compaction",
+                    llm_name=self.cfg.fast_llm_model)
+                if summary.strip():
+                    return summary.strip()
+            except:
+                print(traceback.format_exc())
+        return extractive_summary(result, goal + " " + task.get("task_name", ""), self.cfg.memory_summary_max_length)
     
     def initialize_tokenizer(self, llm_name):
-        if "baichuan" in llm_name:
-            model_name = "kwaikeg/kagentlms_baichuan2_13b_mat"
-        elif "qwen" in llm_name:
-            model_name = "kwaikeg/kagentlms_qwen_7b_mat"
-        else:
-            model_name = "gpt2"
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_name,
-            use_fast=False,
-            padding_side='left',
-            trust_remote_code=True
-        )
-        return tokenizer
+        return get_tokenizer(llm_name, self.cfg)
 
     def tool_retrival(self, tools):
         if tools:
-            self.tools = [tool_cls(cfg=self.cfg) for tool_cls in tools]
+            self.tools = [TOOLS.get(tool_cls) for tool_cls in tools]
         else:
-            if "notool" in self.agent_profile.tools:
-                self.tools = list()
-            else:
-                all_tools = [tool_cls(cfg=self.cfg) for tool_cls in ALL_TOOLS]
-
-                if "auto" in self.agent_profile.tools:
-                    used_tools = [tool_cls(cfg=self.cfg) for tool_cls in ALL_TOOLS]
-                else:
-                    used_tools = list()
-                    for tool in all_tools:
-                        if tool.zh_name in self.agent_profile.tools or tool.name in self.agent_profile.tools:
-                            used_tools.append(tool)
-                used_tools += [tool_cls(cfg=self.cfg) for tool_cls in ALL_NO_TOOLS]
-            
-            self.tools = used_tools
+            self.tools = TOOLS.resolve(self.agent_profile.tools)
         self.name2tools = {t.name: t for t in self.tools}
 
     def memory_retrival(self, 
         goal: str, 
         conversation_history: List[List], 
-        complete_task_list: List[Dict]):
-
-        memory = ""
-        if conversation_history:
-            memory += f"* Conversation History:\n"
-            for tmp in conversation_history[-3:]:
-                memory += f"User: {tmp['query']}\nAssistant:{tmp['answer']}\n"
+        complete_task_list: List[Dict],
+        compact: bool = True):
+        return self.memory_builder.build(conversation_history, complete_task_list, goal, compact)
 
-        if complete_task_list:
-            complete_task_str = json.dumps(complete_task_list, ensure_ascii=False, indent=4)
-            memory += f"* Complete tasks: {complete_task_str}\n"
-        return memory
+    @property
+    def prompt_time_quantum(self):
+        if self.cfg.prompt_layout == "prefix_cache":
+            return self.cfg.prompt_time_quantum
+        return None
 
     def task_plan(self, goal, memory):
-        prompt = make_planning_prompt(self.agent_profile, goal, self.tools, memory, self.cfg.max_tokens_num, self.tokenizer, lang=self.lang)
+        multi_task = self.cfg.multi_task_planning
+        prompt = make_planning_prompt(self.agent_profile, goal, self.tools, memory, self.cfg.max_tokens_num, self.tokenizer, lang=self.lang,
+            prompt_layout=self.cfg.prompt_layout, time_quantum=self.prompt_time_quantum, multi_task=multi_task)
         # print(f'\n************** TASK PLAN AGENT PROMPT *************')
         # print(prompt)
+        response = ""
         try:
             response, _ = create_chat_completion(
-            query=prompt, llm_model_name=self.cfg.smart_llm_model)
+            query=prompt, llm_model_name=self.cfg.smart_llm_model, session_id=self.session_id,
+            usage_tracker=self.usage_tracker, stage="auto_task_create",
+            generation_profile="multi_planning" if multi_task else "planning",
+            budget=self.budget)
             self.chain_logger.put_prompt_response(
                 prompt=prompt, 
                 response=response, 
                 session_id=self.session_id, 
                 mtype="auto_task_create",
                 llm_name=self.cfg.smart_llm_model)
-            response = correct_json(find_json_dict(response))
-            task = json.loads(response)
-            new_tasks = [task]
+            if multi_task and response.strip().startswith("["):
+                new_tasks = json.loads(correct_json(find_json_list(response)))
+                # items that are not tasks, e.g. plain strings, are dropped, a plan without any task failed
+                new_tasks = [task for task in new_tasks if isinstance(task, dict)] if isinstance(new_tasks, list) else list()
+                if not new_tasks:
+                    raise ValueError("No task in the planned task list")
+            else:
+                response = correct_json(find_json_dict(response))
+                task = json.loads(response)
+                new_tasks = [task]
         except:
             print(traceback.format_exc())
             print("+" + response)
@@ -151,30 +233,9 @@ class KAgentSysLite(object):
 
     def tool_use(self, command) -> str:
         try:
-            command_name = command.get("name", "")
-            if command_name == "search":
-                command_name = "web_search"
-            args_text = ",".join([f'{key}={val}' for key, val in command["args"].items()])
-            execute_str = f'{command_name}({args_text})'.replace("wikipedia(", "kuaipedia(")
-            self.chain_logger.put("execute", execute_str)
-            if not command_name:
-                raise RuntimeError("{} has no tool name".format(command))
-            if command_name not in self.name2tools:
-                raise RuntimeError("has no tool named {}".format(command_name))
-            tool = self.name2tools[command_name]
-
-            tool_output = tool(**command["args"])
-            self.chain_logger.put("observation", tool_output.answer_md)
-
-            for prompt, response in tool_output.prompt_responses:
-                self.chain_logger.put_prompt_response(
-                    prompt=prompt,
-                    response=response,
-                    session_id=self.session_id,
-                    mtype=f"auto_command_{command_name}",
-                    llm_name=self.cfg.fast_llm_model
-                )
-            return tool_output.answer
+            command_name, tool = self.prepare_tool_use(command)
+            tool_output = tool.invoke(cfg=self.cfg, **command["args"])
+            return self.observe_tool_output(command_name, tool_output)
         except KeyboardInterrupt:
             exit()
         except:
@@ -182,6 +243,125 @@ class KAgentSysLite(object):
             self.chain_logger.put("observation", logging_execute_fail_msg(self.lang))
             return ""
 
+    def prepare_tool_use(self, command):
+        command_name = command.get("name", "")
+        if command_name == "search":
+            command_name = "web_search"
+        args_text = ",".join([f'{key}={val}' for key, val in command["args"].items()])
+        execute_str = f'{command_name}({args_text})'.replace("wikipedia(", "kuaipedia(")
+        self.chain_logger.put("execute", execute_str)
+        if not command_name:
+            raise RuntimeError("{} has no tool name".format(command))
+        if command_name not in self.name2tools:
+            raise RuntimeError("has no tool named {}".format(command_name))
+        return command_name, self.name2tools[command_name]
+
+    def observe_tool_output(self, command_name, tool_output):
+        if tool_output.cached:
+            self.chain_logger.put("observation", logging_tool_cache_hit_msg(self.lang))
+        self.chain_logger.put("observation", tool_output.answer_md)
+        self.prefetch_search_results(tool_output)
+
+        for prompt, response in tool_output.prompt_responses:
+            self.chain_logger.put_prompt_response(
+                prompt=prompt,
+                response=response,
+                session_id=self.session_id,
+                mtype=f"auto_command_{command_name}",
+                llm_name=self.cfg.fast_llm_model
+            )
+        return tool_output.answer
+
+    def prefetch_search_results(self, tool_output):
+        """Start loading the top search result pages, the next step is often to browse one of them"""
+        if not self.cfg.browse_prefetch or not isinstance(tool_output, SearchResult) \
+                or BrowserTool.name not in self.name2tools or not tool_output.json_data:
+            return
+        urls = [item.get("href") for item in tool_output.json_data[:self.cfg.browse_prefetch_top_n]]
+        prefetch_pages([url for url in urls if url], self.cfg, self.session_id)
+
+    def cancel_prefetches(self):
+        prefetcher = get_page_prefetcher(self.cfg)
+        if prefetcher is not None:
+            prefetcher.cancel_session(self.session_id)
+
+    @staticmethod
+    def command_key(command):
+        command_name = command.get("name", "")
+        if command_name == "search":
+            command_name = "web_search"
+        return make_tool_call_key(command_name, command.get("args", dict()))
+
+    def filter_repeated_tasks(self, tasks):
+        """Handle the tasks repeating an executed command by `cfg.duplicate_command_policy`.
+
+        "reuse" gives them the stored result, "replan" a note pointing to the
+        earlier task, and "conclude" (or more than `duplicate_command_max_repeats`
+        repeats) ends the session. Returns the tasks left to run, the handled
+        repeats and whether to conclude.
+        """
+        policy = self.cfg.duplicate_command_policy
+        if not policy:
+            return tasks, list(), False
+        new_tasks, repeated_tasks = list(), list()
+        for task in tasks:
+            done_task = self.executed_commands.get(self.command_key(task["command"]))
+            if done_task is None:
+                new_tasks.append(task)
+                continue
+            self.duplicate_stats["repeats"] += 1
+            self.chain_logger.put("thought", task.get("task_name", ""))
+            if policy == "conclude" or self.duplicate_stats["repeats"] > self.cfg.duplicate_command_max_repeats:
+                self.duplicate_stats["concluded"] += 1
+                self.chain_logger.put("finish", logging_duplicate_command_conclude_msg(self.lang))
+                return list(), list(), True
+            if policy == "replan":
+                self.duplicate_stats["replanned"] += 1
+                self.chain_logger.put("observation", logging_duplicate_command_replan_msg(self.lang))
+                task["result"] = make_duplicate_command_note(done_task.get("task_id"), self.lang)
+            else:
+                self.duplicate_stats["reused"] += 1
+                self.chain_logger.put("observation", logging_duplicate_command_reuse_msg(self.lang))
+                task["result"] = done_task["result"]
+            repeated_tasks.append(task)
+        return new_tasks, repeated_tasks, False
+
+    def run_tasks(self, tasks):
+        """Run the tools of independent tasks concurrently and store each result in its task.
+
+        Thoughts and executions are logged in task order before the tools start,
+        observations in task order once they are done.
+        """
+        if len(tasks) == 1:
+            self.chain_logger.put("thought", tasks[0].get("task_name", ""))
+            tasks[0]["result"] = self.tool_use(tasks[0]["command"])
+            return
+
+        with ThreadPoolExecutor(max_workers=max(self.cfg.max_parallel_tools, 1)) as executor:
+            futures = list()
+            for task in tasks:
+                self.chain_logger.put("thought", task.get("task_name", ""))
+                try:
+                    command_name, tool = self.prepare_tool_use(task["command"])
+                    # every worker runs in a copy of the session context
+                    futures.append((command_name, executor.submit(
+                        contextvars.copy_context().run, tool.invoke, cfg=self.cfg, **task["command"]["args"])))
+                except:
+                    print(traceback.format_exc())
+                    futures.append((None, None))
+
+            for task, (command_name, future) in zip(tasks, futures):
+                try:
+                    if future is None:
+                        raise RuntimeError("task {} is not executable".format(task.get("task_id")))
+                    task["result"] = self.observe_tool_output(command_name, future.result())
+                except KeyboardInterrupt:
+                    exit()
+                except:
+                    print(traceback.format_exc())
+                    self.chain_logger.put("observation", logging_execute_fail_msg(self.lang))
+                    task["result"] = ""
+
     def conclusion(self, 
         goal: str, 
         memory,
@@ -192,14 +372,27 @@ class KAgentSysLite(object):
         if no_task_planned:
             prompt = make_no_task_conclusion_prompt(goal, conversation_history)
         else:
-            prompt = make_task_conclusion_prompt(self.agent_profile, goal, memory, self.cfg.max_tokens_num, self.tokenizer, lang=self.lang)
+            prompt = make_task_conclusion_prompt(self.agent_profile, goal, memory, self.cfg.max_tokens_num, self.tokenizer, lang=self.lang,
+                time_quantum=self.prompt_time_quantum)
         # print(f'\n************** CONCLUSION AGENT PROMPT *************')
         # print(prompt)
 
+        # the conclusion is made even when the budget is used up
+        stream_callback = None
+        if self.cfg.stream_conclusion:
+            stream_callback = lambda token: self.chain_logger.put_stream("conclusion", token)
+
         response, _ = create_chat_completion(
             query=prompt, 
             chat_id="kwaiagents_answer_" + self.session_id, 
-            llm_model_name=self.cfg.smart_llm_model)
+            llm_model_name=self.cfg.smart_llm_model,
+            session_id=self.session_id,
+            stream_callback=stream_callback,
+            usage_tracker=self.usage_tracker,
+            stage="auto_conclusion",
+            generation_profile="conclusion",
+            tokenizer=self.tokenizer)
+        self.chain_logger.end_stream("conclusion")
 
         # print(response)
 
@@ -211,13 +404,19 @@ class KAgentSysLite(object):
             llm_name=self.cfg.smart_llm_model)
         return response
 
+    def is_task_complete(self, task):
+        if not isinstance(task, dict) or ("task_name" not in task) or not isinstance(task.get("command"), dict) \
+            or ("args" not in task["command"]) or ("name" not in task["command"]):
+            return True
+        return task["command"]["name"] in [FinishTool.name, NoTool.name] or task["command"]["name"] not in self.name2tools
+
     def check_task_complete(self, task, iter_id):
-        command_name = task["command"]["name"]
-        if not task or ("task_name" not in task) or ("command" not in task) \
+        if not isinstance(task, dict) or ("task_name" not in task) or not isinstance(task.get("command"), dict) \
             or ("args" not in task["command"]) or ("name" not in task["command"]):
-            self.chain_logger.put("finish", str(task.get("task_name", "")))
+            self.chain_logger.put("finish", str(task.get("task_name", "")) if isinstance(task, dict) else "")
             return True
-        elif command_name == FinishTool.name:
+        command_name = task["command"]["name"]
+        if command_name == FinishTool.name:
             self.chain_logger.put("finish", str(task["command"]["args"].get("reason", "")))
             return True
         elif command_name == NoTool.name:
@@ -233,53 +432,82 @@ class KAgentSysLite(object):
             return False
 
     def chat(self, query, history=list(), initial_task_name=None, *args, **kwargs):
+        with session_config(self.cfg):
+            try:
+                return self.run_chat(query, history, initial_task_name, *args, **kwargs)
+            finally:
+                self.cancel_prefetches()
+
+    def run_chat(self, query, history=list(), initial_task_name=None, *args, **kwargs):
         goal = query
+        complete_task_list = list()
+        self.executed_commands = dict()
+        self.duplicate_stats = {"repeats": 0, "reused": 0, "replanned": 0, "concluded": 0}
 
         if not self.tools:
             no_task_planned = True
         else:
-            tasks_storage = SingleTaskListStorage()
+            tasks_storage = TaskGraphStorage()
             tasks_storage.clear()
 
             start = True
             loop = True
             iter_id = 0
-            complete_task_list = list()
+            # iterations answered from executed commands do not count against max_iter_num
+            repeat_iter_num = 0
             no_task_planned = False
             while loop:
                 iter_id += 1
                 if start or not tasks_storage.is_empty():
                     start = False
+                    if not self.within_budget():
+                        break
                     if not tasks_storage.is_empty():
-                        task = tasks_storage.popleft()
-                        
-                        if (self.check_task_complete(task, iter_id,)):
+                        tasks = tasks_storage.pop_ready()
+                        tool_tasks = [task for task in tasks if not self.is_task_complete(task)]
+
+                        if not tool_tasks:
+                            self.check_task_complete(tasks[0], iter_id)
                             if iter_id <= 2:
                                 no_task_planned = True
                             break
 
-                        self.chain_logger.put("thought", task.get("task_name", ""))
-
-                        result = self.tool_use(task["command"])
-
-                        task["result"] = result
-                        complete_task_list.append(task)
-
-                    if iter_id > self.agent_profile.max_iter_num:
+                        new_tasks, repeated_tasks, conclude = self.filter_repeated_tasks(tool_tasks)
+                        if conclude:
+                            break
+                        if new_tasks:
+                            self.run_tasks(new_tasks)
+                        else:
+                            repeat_iter_num += 1
+
+                        for task in tool_tasks:
+                            tasks_storage.mark_done(task)
+                            complete_task_list.append(task)
+                        for task in new_tasks:
+                            # failed commands may be retried
+                            if task["result"]:
+                                self.executed_commands[self.command_key(task["command"])] = task
+
+                    if iter_id - repeat_iter_num > self.agent_profile.max_iter_num:
                         self.chain_logger.put("finish", logging_stop_thinking_msg(self.lang))
                         break
+                    if not tasks_storage.is_empty():
+                        continue
+                    if not self.within_budget():
+                        break
                     self.chain_logger.put("thinking")
                     memory = self.memory_retrival(goal, history, complete_task_list)
                     new_tasks = self.task_plan(goal, memory)
 
-                    for new_task in new_tasks:
-                        new_task.update({"task_id": tasks_storage.next_task_id()})
-                        tasks_storage.append(new_task)
+                    tasks_storage.add_tasks(new_tasks)
                 else:
                     loop = False
                     self.chain_logger.put("finish", logging_finish_task_msg(self.lang))
 
-        memory = self.memory_retrival(goal, history, complete_task_list)
+        # no page is browsed after planning
+        self.cancel_prefetches()
+        # the conclusion gets the full results, its prompt is truncated to fit anyway
+        memory = self.memory_retrival(goal, history, complete_task_list, compact=False)
         self.chain_logger.put("conclusion", "")
 
         conclusion = self.conclusion(
@@ -296,5 +524,13 @@ class KAgentSysLite(object):
             "history": new_history,
             "chain_msg": self.chain_logger.chain_msgs,
             "chain_msg_str": self.chain_logger.chain_msgs_str,
-            "more_info": {},
+            "complete_tasks": self.memory_builder.get_compact_tasks(),
+            "more_info": {
+                "usage": self.usage_tracker.to_dict(),
+                "tool_cache": get_tool_cache_stats(self.cfg),
+                "memory": dict(self.memory_builder.stats),
+                "duplicate_commands": dict(self.duplicate_stats),
+                "budget": self.budget.to_dict(),
+                "prefetch": get_page_prefetch_stats(self.cfg)
+            },
         }
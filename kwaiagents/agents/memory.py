@@ -0,0 +1,139 @@
+import json
+from typing import Dict, List
+
+
+class MemorySegment(object):
+    """A piece of memory text whose token ids are computed once"""
+    def __init__(self, text):
+        self.text = text
+        self._tokenizer = None
+        self._tokens = None
+
+    def get_tokens(self, tokenizer):
+        if self._tokens is None or self._tokenizer is not tokenizer:
+            self._tokens = list(tokenizer.encode(self.text, add_special_tokens=False))
+            self._tokenizer = tokenizer
+        return self._tokens
+
+
+class SegmentedMemory(str):
+    """The memory text of a prompt, together with the segments it is made of.
+
+    It is a plain string for templates and callers, `prompt_truncate` uses
+    the cached token ids of the segments instead of re-encoding the memory.
+    """
+    def __new__(cls, segments):
+        memory = super().__new__(cls, "".join(segment.text for segment in segments))
+        memory.segments = segments
+        return memory
+
+    def get_tokens(self, tokenizer):
+        tokens = list()
+        for segment in self.segments:
+            tokens.extend(segment.get_tokens(tokenizer))
+        return tokens
+
+    def count_tokens(self, tokenizer):
+        return sum(len(segment.get_tokens(tokenizer)) for segment in self.segments)
+
+
+def dump_task(task, indent=4):
+    """A task as it is nested in `json.dumps(complete_task_list, indent=indent)`"""
+    task_str = json.dumps(task, ensure_ascii=False, indent=indent)
+    return "\n".join(" " * indent + line for line in task_str.split("\n"))
+
+
+class MemoryBuilder(object):
+    """Builds the memory of the planning and conclusion prompts incrementally.
+
+    Every completed task is serialized once, when it is first seen, and kept
+    as a segment with its own cached token ids. The produced text is the same
+    as dumping the whole `complete_task_list` on every iteration.
+
+    With a `tokenizer` and a `token_budget`, memories over budget are
+    compacted: starting from the oldest, task results are replaced by the
+    `summarize(task, goal)` summary until the memory fits, while the newest
+    `keep_recent_tasks` results stay verbatim. Summaries are made once per task.
+    `build(..., compact=False)` gives the full memory whatever the budget.
+    """
+    def __init__(self, tokenizer=None, token_budget=0, keep_recent_tasks=2, summarize=None):
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.keep_recent_tasks = keep_recent_tasks
+        self.summarize = summarize
+        self.history_segment = None
+        self.task_segments = list()
+        self.compact_segments = list()
+        self.summaries = dict()
+        self.tasks = list()
+        self.stats = {"compactions": 0, "summaries": 0}
+        self.tasks_head = MemorySegment("* Complete tasks: [\n")
+        self.tasks_tail = MemorySegment("\n]\n")
+
+    def make_history_segment(self, conversation_history):
+        text = ""
+        if conversation_history:
+            text += f"* Conversation History:\n"
+            for tmp in conversation_history[-3:]:
+                text += f"User: {tmp['query']}\nAssistant:{tmp['answer']}\n"
+        if self.history_segment is None or self.history_segment.text != text:
+            self.history_segment = MemorySegment(text)
+        return self.history_segment
+
+    def update_tasks(self, complete_task_list: List[Dict]):
+        # a new task list, e.g. of the next chat, starts over
+        cnt = len(self.tasks)
+        if len(complete_task_list) < cnt or (cnt and complete_task_list[cnt - 1] is not self.tasks[-1]):
+            self.task_segments = list()
+            self.compact_segments = list()
+            self.summaries = dict()
+            self.tasks = list()
+        for task in complete_task_list[len(self.tasks):]:
+            self.task_segments.append(MemorySegment(self.task_prefix(len(self.tasks)) + dump_task(task)))
+            self.compact_segments.append(None)
+            self.tasks.append(task)
+
+    @staticmethod
+    def task_prefix(idx):
+        return ",\n" if idx > 0 else ""
+
+    def get_compact_segment(self, idx, goal):
+        if self.compact_segments[idx] is None:
+            task = self.tasks[idx]
+            summary = self.summarize(task, goal)
+            self.stats["summaries"] += 1
+            segment = self.task_segments[idx]
+            if summary and len(summary) < len(str(task.get("result", ""))):
+                segment = MemorySegment(self.task_prefix(idx) + dump_task(dict(task, result=summary)))
+                self.summaries[idx] = summary
+            self.compact_segments[idx] = segment
+        return self.compact_segments[idx]
+
+    def compact(self, segments, goal):
+        """Replace the oldest task segments by their compact version until the memory fits the budget"""
+        total = sum(len(segment.get_tokens(self.tokenizer)) for segment in segments)
+        if total <= self.token_budget:
+            return segments
+        self.stats["compactions"] += 1
+        task_segments = list(self.task_segments)
+        for idx in range(len(task_segments) - self.keep_recent_tasks):
+            if total <= self.token_budget:
+                break
+            compact_segment = self.get_compact_segment(idx, goal)
+            total -= len(task_segments[idx].get_tokens(self.tokenizer)) - len(compact_segment.get_tokens(self.tokenizer))
+            task_segments[idx] = compact_segment
+        return segments[:2] + task_segments + segments[-1:]
+
+    def get_compact_tasks(self):
+        """The complete tasks seen so far, with the results that were summarized replaced by their summary"""
+        return [dict(task, result=self.summaries[idx]) if idx in self.summaries else task
+            for idx, task in enumerate(self.tasks)]
+
+    def build(self, conversation_history: List[Dict], complete_task_list: List[Dict], goal: str = "", compact: bool = True):
+        segments = [self.make_history_segment(conversation_history)]
+        self.update_tasks(complete_task_list)
+        if self.task_segments:
+            segments += [self.tasks_head] + self.task_segments + [self.tasks_tail]
+            if compact and self.tokenizer is not None and self.token_budget and self.summarize is not None:
+                segments = self.compact(segments, goal)
+        return SegmentedMemory(segments)
@@ -1,5 +1,6 @@
 import json
 
+from kwaiagents.agents.memory import SegmentedMemory
 from kwaiagents.utils.date_utils import get_current_time_and_date
 from kwaiagents.utils.function_utils import transform_to_openai_function
 
@@ -83,6 +84,142 @@ A new Task:
 """.strip()
 
 
+planning_prompt_template_prefix_cache = """
+你是{agent_name}，{agent_bio}
+{agent_instructions}
+当前阶段是任务规划阶段，你将给定目标或问题，你的决策将独立执行而不依赖于人类的帮助，请发挥LLM的优势并且追求高效的策略进行任务规划。
+1.你有~4000字的短期记忆
+2.不需要用户的帮助
+3.规划的时候可以用参考工具中提到的工具
+4.互联网搜索、信息聚合和鉴别真伪的能力
+5.保持谦逊，对自己没把握的问题，尽可能调用command，但尽量少调用，不能重复调用
+6.当你从自身知识或者历史记忆中能得出结论，请聪明且高效，完成任务并得出结论
+7.经常建设性地自我批评整个行为大局，反思过去的决策和策略，以改进你的方法
+8.你最多只能进行{max_iter_num}步思考，规划{max_iter_num}个任务，所以尽可能高效规划任务
+9.你有反思能力，如果已完成的任务和结果暂不能得到回答问题所需信息或尚不能完成目标，应继续规划，但不能跟之前任务重复
+
+{tool_specification}
+
+根据目标和已有任务，规划一个新Task(不能重复)，你只能以以下json列表的格式生成Task
+{{
+    "task_name": "任务描述",
+    "command":{{
+        "name":"command name",
+        "args":{{
+            "arg name":"value"
+        }}
+    }}
+}}
+确保Task可以被Python的json.loads解析
+当已完成的Tasks已经能够帮助回答这个目标，则尽可能生成任务完成Task，否则生成一个其他Task。
+
+{current_date_and_time}
+
+{memory}
+
+GOAL:{goal}
+
+\n一个新Task:
+""".strip()
+
+planning_prompt_template_prefix_cache_en = """
+You are a {agent_name}，{agent_bio}
+{agent_instructions}
+Currently, you are in the task planning phase, where you will be given specific goals or problems to address. \
+Your decisions will be executed independently without relying on human assistance. \
+Please utilize LLM's advantages and pursue efficient strategies for task planning.\
+
+1. You have a short-term memory of approximately 4,000 characters.
+2. You do not require assistance from users.
+3. You can use the reference tools mentioned when planning.
+4. You have the abilities to perform internet searches, aggregate information, and discern between genuine and fake information.
+5. Remain humble and, if unsure about an issue, make use of commands when possible but minimize their usage and avoid repetition.
+6. When drawing conclusions from your knowledge or historical memory, be clever and efficient in task completion and conclusion.
+7. Regularly engage in constructive self-criticism to reflect on past decisions and strategies and improve your approach.
+8. You can think and plan up to {max_iter_num} steps, so strive to plan tasks as efficiently as possible.
+9. You have the capability for reflection; if a completed task and its results cannot provide the necessary information to answer a question or achieve a goal, continue planning but avoid repeating previous tasks.
+
+{tool_specification}
+
+Based on the goal and existing tasks, plan a new Task (no repetitions), and you can only generate the Task in the following json list format:
+{{
+    "task_name": "task description",
+    "command":{{
+        "name":"command name",
+        "args":{{
+            "arg name":"value"
+        }}
+    }}
+}}
+Ensure that the Task can be parsed by Python's json.loads function. 
+If the already completed Tasks are sufficient to answer the goal, then try to generate the Task to complete it as much as possible. Otherwise, create another Task. 
+
+{current_date_and_time}
+
+{memory}
+
+GOAL:{goal}
+
+\nA new Task:
+""".strip()
+
+
+_single_task_format = """{{
+    "task_name": "{task_name}",
+    "command":{{
+        "name":"command name",
+        "args":{{
+            "arg name":"value"
+        }}
+    }}
+}}"""
+
+_multi_task_format = """[
+    {{
+        "task_id": 1,
+        "task_name": "{task_name}",
+        "command":{{
+            "name":"command name",
+            "args":{{
+                "arg name":"value"
+            }}
+        }},
+        "dependencies": []
+    }}
+]"""
+
+_multi_task_replacements = {
+    "zh": [
+        ("规划一个新Task(不能重复)，你只能以以下json列表的格式生成Task",
+            "规划若干新Task(不能重复)，互不依赖的Task会被并行执行，你只能以以下json列表的格式生成Task"),
+        (_single_task_format.format(task_name="任务描述"), _multi_task_format.format(task_name="任务描述")),
+        ("确保Task可以被Python的json.loads解析",
+            "dependencies中填写该Task依赖的其他新Task的task_id，没有依赖则为空列表\n确保Task列表可以被Python的json.loads解析"),
+        ("则尽可能生成任务完成Task，否则生成一个其他Task。", "则只生成一个任务完成Task，否则生成其他Task。"),
+        ("一个新Task:", "新Task列表:"),
+    ],
+    "en": [
+        ("plan a new Task (no repetitions), and you can only generate the Task in the following json list format:",
+            "plan new Tasks (no repetitions). Tasks that do not depend on each other are executed in parallel. "
+            "You can only generate the Tasks in the following json list format:"),
+        (_single_task_format.format(task_name="task description"), _multi_task_format.format(task_name="task description")),
+        ("Ensure that the Task can be parsed by Python's json.loads function.",
+            "\"dependencies\" lists the task_id of the other new Tasks this Task depends on, leave it empty if there are none.\n"
+            "Ensure that the Task list can be parsed by Python's json.loads function."),
+        ("then try to generate the Task to complete it as much as possible. Otherwise, create another Task.",
+            "then only generate one Task to complete it. Otherwise, create other Tasks."),
+        ("A new Task:", "New Tasks:"),
+    ]
+}
+
+
+def make_multi_task_template(template, lang):
+    """Turn a single task planning template into one that plans a list of tasks with dependencies"""
+    for single, multi in _multi_task_replacements[lang]:
+        template = template.replace(single.replace("{", "{{").replace("}", "}}"), multi.replace("{", "{{").replace("}", "}}"))
+    return template
+
+
 conclusion_prompt_template = """
 你是{agent_name}，{agent_bio}，{agent_instructions}
 当前阶段是总结阶段，在前几次交互中，对于用户给定的目标和问题，你已经通过自己搜寻出了一定信息，你需要整合这些信息用中文给出最终的结论。
@@ -115,16 +252,30 @@ Generate helpful answers **in English** for users:
 """
 
 
-def make_planning_prompt(agent_profile, goal, used_tools, memory, max_tokens_num, tokenizer, lang="en"):
+def make_planning_prompt(agent_profile, goal, used_tools, memory, max_tokens_num, tokenizer, lang="en",
+        prompt_layout="default", time_quantum=None, multi_task=False):
+    """Make the task planning prompt.
+
+    With `prompt_layout="prefix_cache"` all static content (profile, rules,
+    tool specification and output format) comes first, followed by the
+    current time quantized to `time_quantum` seconds, the memory and the goal,
+    so that consecutive planning calls share a byte-stable prompt prefix.
+    With `multi_task` the model plans a list of tasks with declared dependencies.
+    """
     tool_spec = make_tool_specification(used_tools, lang)
-    template = planning_prompt_template if lang == "zh" else planning_prompt_template_en
+    if prompt_layout == "prefix_cache":
+        template = planning_prompt_template_prefix_cache if lang == "zh" else planning_prompt_template_prefix_cache_en
+    else:
+        template = planning_prompt_template if lang == "zh" else planning_prompt_template_en
+    if multi_task:
+        template = make_multi_task_template(template, "zh" if lang == "zh" else "en")
     prompt = template.format(**{
         "agent_name": agent_profile.name,
         "agent_bio": agent_profile.bio,
         "agent_instructions": agent_profile.instructions,
         "max_iter_num": agent_profile.max_iter_num,
         "tool_specification": tool_spec,
-        "current_date_and_time": get_current_time_and_date(lang),
+        "current_date_and_time": get_current_time_and_date(lang, time_quantum),
         "memory": memory,
         "goal": goal
     })
@@ -148,13 +299,13 @@ def make_tool_specification(tools, lang="en"):
     return tool_spec
 
 
-def make_task_conclusion_prompt(agent_profile, goal, memory, max_tokens_num, tokenizer, lang="en"):
+def make_task_conclusion_prompt(agent_profile, goal, memory, max_tokens_num, tokenizer, lang="en", time_quantum=None):
     template = conclusion_prompt_template if lang == "zh" else conclusion_prompt_template_en
     prompt = template.format(**{
         "agent_name": agent_profile.name,
         "agent_bio": agent_profile.bio,
         "agent_instructions": agent_profile.instructions,
-        "current_date_and_time": get_current_time_and_date(lang),
+        "current_date_and_time": get_current_time_and_date(lang, time_quantum),
         "memory": memory,
         "goal": goal
     })
@@ -162,6 +313,42 @@ def make_task_conclusion_prompt(agent_profile, goal, memory, max_tokens_num, tok
     return prompt
 
 
+memory_summary_prompt_template = """
+目标:{goal}
+任务:{task_name}
+以下是该任务的执行结果，请用不超过{max_length}字总结其中与目标相关的信息，保留关键的事实、数字、日期和链接:
+{result}
+总结:
+""".strip()
+
+memory_summary_prompt_template_en = """
+Goal: {goal}
+Task: {task_name}
+Below is the result of the task. Summarize the information relevant to the goal in at most {max_length} characters, keeping key facts, numbers, dates and links:
+{result}
+Summary:
+""".strip()
+
+
+def make_memory_summary_prompt(goal, task, max_length, lang="en"):
+    template = memory_summary_prompt_template if lang == "zh" else memory_summary_prompt_template_en
+    return template.format(**{
+        "goal": goal,
+        "task_name": task.get("task_name", ""),
+        "max_length": max_length,
+        "result": task.get("result", "")
+    })
+
+
+duplicate_command_note_template = "该命令与任务{task_id}完全相同，结果见任务{task_id}，不要再重复执行。"
+duplicate_command_note_template_en = "This command is the same as the one of task {task_id}, see the result of task {task_id} and do not repeat it."
+
+
+def make_duplicate_command_note(task_id, lang="en"):
+    template = duplicate_command_note_template if lang == "zh" else duplicate_command_note_template_en
+    return template.format(task_id=task_id)
+
+
 def make_no_task_conclusion_prompt(query, conversation_history=""):
     prompt = ""
     if conversation_history:
@@ -173,7 +360,48 @@ def make_no_task_conclusion_prompt(query, conversation_history=""):
     return prompt
 
 
+def count_shared_prefix_tokens(tokenizer, prompt_a, prompt_b):
+    """Count the leading tokens two prompts share, i.e. what a server-side prefix cache can reuse"""
+    kwargs = dict(add_special_tokens=False)
+    tokens_a = tokenizer.encode(prompt_a, **kwargs)
+    tokens_b = tokenizer.encode(prompt_b, **kwargs)
+    cnt = 0
+    for a, b in zip(tokens_a, tokens_b):
+        if a != b:
+            break
+        cnt += 1
+    return cnt
+
+
+def count_tokens(tokenizer, text):
+    if hasattr(tokenizer, "count_tokens"):
+        return tokenizer.count_tokens(text)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def segmented_prompt_truncate(tokenizer, prompt, memory, input_max_length):
+    """Truncate the middle of a `SegmentedMemory` using the cached token ids of its segments.
+
+    Returns:
+        str: The prompt, unchanged if it fits, or None if the rest of the prompt alone is too long.
+    """
+    head, tail = prompt.split(memory, 1)
+    other_len = count_tokens(tokenizer, head) + count_tokens(tokenizer, tail)
+    if other_len + memory.count_tokens(tokenizer) <= input_max_length:
+        return prompt
+    if input_max_length <= other_len:
+        return None
+    max_memory_len = input_max_length - other_len
+    memory_prompt_tokens = memory.get_tokens(tokenizer)
+    memory_prompt_tokens = memory_prompt_tokens[:max_memory_len//2] + memory_prompt_tokens[-max_memory_len//2:]
+    return head + tokenizer.decode(memory_prompt_tokens, skip_special_tokens=True) + tail
+
+
 def prompt_truncate(tokenizer, prompt, memory, input_max_length):
+    if isinstance(memory, SegmentedMemory) and memory and memory in prompt:
+        truncated_prompt = segmented_prompt_truncate(tokenizer, prompt, memory, input_max_length)
+        if truncated_prompt is not None:
+            return truncated_prompt
     kwargs = dict(add_special_tokens=False)
     prompt_tokens = tokenizer.encode(prompt, **kwargs)
     if len(prompt_tokens) > input_max_length:
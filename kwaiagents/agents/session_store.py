@@ -0,0 +1,209 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from kwaiagents.config import CFG
+
+
+class SessionStore(ABC):
+    """Server-side state of conversations, keyed by session id.
+
+    A session is a json serializable dict such as
+    `{"history": [...]}`. Sessions not updated for
+    `ttl` seconds expire, and beyond `max_sessions` the least recently
+    updated ones are evicted.
+    """
+    def __init__(self, max_sessions=10000, ttl=7 * 24 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, session_id):
+        pass
+
+    @abstractmethod
+    def put(self, session_id, session):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id):
+        pass
+
+    @abstractmethod
+    def evict(self):
+        """Drop the expired and the least recently updated sessions, returns how many were dropped"""
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_sessions=10000, ttl=7 * 24 * 3600):
+        super().__init__(max_sessions, ttl)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            item = self._sessions.get(str(session_id))
+            if item is None:
+                return None
+            updated_at, session = item
+            if self.ttl is not None and time.time() - updated_at > self.ttl:
+                del self._sessions[str(session_id)]
+                return None
+            # sessions are copied in and out, like they are with a database
+            return json.loads(session)
+
+    def put(self, session_id, session):
+        with self._lock:
+            self._sessions[str(session_id)] = (time.time(), json.dumps(session, ensure_ascii=False))
+            self._sessions.move_to_end(str(session_id))
+        self.evict()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(str(session_id), None)
+
+    def evict(self):
+        cnt = 0
+        with self._lock:
+            now = time.time()
+            while self._sessions:
+                session_id, (updated_at, _) = next(iter(self._sessions.items()))
+                expired = self.ttl is not None and now - updated_at > self.ttl
+                if not expired and len(self._sessions) <= self.max_sessions:
+                    break
+                del self._sessions[session_id]
+                cnt += 1
+        return cnt
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite database file, shared by the threads and the processes using it.
+
+    Eviction runs every `evict_interval` writes.
+    """
+    def __init__(self, path, max_sessions=10000, ttl=7 * 24 * 3600, evict_interval=100):
+        super().__init__(max_sessions, ttl)
+        self.path = path
+        self.evict_interval = evict_interval
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM sessions WHERE id = ?", (str(session_id),)).fetchone()
+        if row is None:
+            return None
+        data, updated_at = row
+        if self.ttl is not None and time.time() - updated_at > self.ttl:
+            self.delete(session_id)
+            return None
+        return json.loads(data)
+
+    def put(self, session_id, session):
+        data = json.dumps(session, ensure_ascii=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (str(session_id), data, time.time()))
+            self._writes += 1
+            evict = self._writes % self.evict_interval == 0
+        if evict:
+            self.evict()
+
+    def delete(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (str(session_id),))
+
+    def evict(self):
+        with self._lock, self._conn:
+            cnt = 0
+            if self.ttl is not None:
+                cnt += self._conn.execute(
+                    "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,)).rowcount
+            cnt += self._conn.execute(
+                "DELETE FROM sessions WHERE id IN "
+                "(SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (self.max_sessions,)).rowcount
+        return cnt
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionLocks(object):
+    """Serialize the requests of one session, so that concurrent turns do not overwrite each other.
+
+    A lock only lives while a request holds or waits for it.
+    """
+    def __init__(self):
+        # session id -> [lock, number of requests holding or waiting for it]
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, session_id):
+        key = str(session_id)
+        with self._lock:
+            item = self._locks.setdefault(key, [threading.Lock(), 0])
+            item[1] += 1
+        try:
+            with item[0]:
+                yield
+        finally:
+            with self._lock:
+                item[1] -= 1
+                if not item[1]:
+                    del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+SESSION_LOCKS = SessionLocks()
+
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store(cfg=CFG):
+    """Return the process-wide session store, or None when `cfg.session_store` is empty"""
+    global _session_store
+    if not cfg.session_store:
+        return None
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                if cfg.session_store == "sqlite":
+                    _session_store = SQLiteSessionStore(
+                        cfg.session_store_path, max_sessions=cfg.session_max_num, ttl=cfg.session_ttl)
+                elif cfg.session_store == "memory":
+                    _session_store = MemorySessionStore(max_sessions=cfg.session_max_num, ttl=cfg.session_ttl)
+                else:
+                    raise ValueError(f"Unknown session store: {cfg.session_store}")
+    return _session_store
@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+import contextvars
+import copy
 import os
 import json
 from kwaiagents.utils.chain_logger import ChainMessageLogger
@@ -11,13 +14,75 @@ class Config(object):
         self.use_local_llm = False
         self.local_llm_host = "localhost"
         self.local_llm_port = 8888
+        self.local_llm_endpoints = dict()
+        self.llm_sticky_sessions = False
+        self.llm_sticky_max_sessions = 10000
+        self.llm_endpoint_max_failures = 3
+        self.llm_health_check_interval = 10.0
+        self.llm_pool_connections = 10
+        self.llm_pool_maxsize = 32
+        self.llm_connect_timeout = 5
+        self.llm_read_timeout = 300
         self.browse_chunk_max_length = 4096
         self.browse_summary_max_token = 300
+        self.browse_summary_batch_size = 4
         self.selenium_web_browser = "chrome"
+        self.browse_prefetch = False
+        self.browse_prefetch_top_n = 2
+        self.browse_prefetch_max_workers = 2
+        self.browse_prefetch_max_pages = 16
+        self.browse_prefetch_ttl = 300
         self.llm_max_retries = 5
+        self.llm_retry_base_delay = 1.0
+        self.llm_retry_max_delay = 16.0
+        self.llm_retry_deadline = 60.0
+        self.llm_breaker_failure_threshold = 5
+        self.llm_breaker_reset_timeout = 30.0
+        self.llm_singleflight = True
+        self.llm_singleflight_timeout = 300.0
+        self.llm_cache_enabled = False
+        self.llm_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "kwaiagents", "llm")
+        self.llm_cache_max_memory_entries = 1024
+        self.llm_cache_max_disk_bytes = 512 * 1024 * 1024
+        self.llm_cache_ttl = 7 * 24 * 3600
+        self.llm_cache_max_temperature = 0.0
+        self.tool_cache_enabled = True
+        self.tool_cache_backend = "memory"
+        self.tool_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "kwaiagents", "tools")
+        self.tool_cache_max_memory_entries = 1024
+        self.tool_cache_max_disk_bytes = 256 * 1024 * 1024
         self.temperature = 1.0
+        self.generation_profiles = dict()
         self.max_tokens_num = 4096
+        self.memory_compaction = False
+        # None is half of max_tokens_num
+        self.memory_token_budget = None
+        self.memory_keep_recent_tasks = 2
+        self.memory_summary_method = "extractive"
+        self.memory_summary_max_length = 400
+        # "sqlite" or "memory" to keep conversations server-side, kagentsys-server uses sqlite
+        self.session_store = ""
+        self.session_store_path = os.path.join(os.path.expanduser("~"), ".cache", "kwaiagents", "sessions.db")
+        self.session_max_num = 10000
+        self.session_ttl = 7 * 24 * 3600
+        self.session_timeout = None
+        self.session_max_tokens = None
+        self.session_max_tool_calls = None
+        self.session_max_browse_pages = None
+        self.selenium_page_load_timeout = 30
+        self.tokenizer_prefer_fast = True
+        self.tokenizer_encode_cache_size = 1024
+        self.prompt_layout = "default"
+        self.multi_task_planning = False
+        self.max_parallel_tools = 4
+        # "reuse", "replan" or "conclude" when the planner repeats an executed command, "" runs it again
+        self.duplicate_command_policy = "reuse"
+        self.duplicate_command_max_repeats = 2
+        self.prompt_time_quantum = 60
+        self.stream_conclusion = True
         self.chain_logger = ChainMessageLogger()
+        self.usage_tracker = None
+        self.session_budget = None
 
     def __str__(self):
         s = "============ CONFIG ============\n"
@@ -27,9 +92,49 @@ class Config(object):
 
     def to_json_file(self, fname):
         with open(fname, "w") as f:
-            json.dump({k:v for k, v in self.__dict__.items() if k not in ["chain_logger"]},f, ensure_ascii=False, indent=2)
+            json.dump({k:v for k, v in self.__dict__.items() if k not in ["chain_logger", "usage_tracker", "session_budget"]},f, ensure_ascii=False, indent=2)
 
     def set_chain_logger(self, chain_logger):
         self.chain_logger = chain_logger
 
-CFG = Config()
\ No newline at end of file
+    def set_usage_tracker(self, usage_tracker):
+        self.usage_tracker = usage_tracker
+
+    def set_session_budget(self, session_budget):
+        self.session_budget = session_budget
+
+    def copy(self):
+        """A copy to customize for one session, without its logger, usage tracker and budget"""
+        cfg = copy.copy(self)
+        cfg.local_llm_endpoints = dict(self.local_llm_endpoints)
+        cfg.generation_profiles = dict(self.generation_profiles)
+        cfg.chain_logger = ChainMessageLogger()
+        cfg.usage_tracker = None
+        cfg.session_budget = None
+        return cfg
+
+CFG = Config()
+
+_SESSION_CFG = contextvars.ContextVar("kwaiagents_session_cfg", default=None)
+
+
+def get_cfg():
+    """The config of the session running in the current context, `CFG` outside of sessions"""
+    cfg = _SESSION_CFG.get()
+    return cfg if cfg is not None else CFG
+
+
+@contextmanager
+def session_config(cfg):
+    """Make `cfg` the config of the current thread or asyncio task until the block exits.
+
+    LLM calls and tools read the backend, logger, usage tracker and budget of
+    the session from it, so sessions running concurrently in one process do
+    not share mutable settings. Threads started inside the block only see it
+    when run with `contextvars.copy_context().run`.
+    """
+    token = _SESSION_CFG.set(cfg)
+    try:
+        yield cfg
+    finally:
+        _SESSION_CFG.reset(token)
\ No newline at end of file
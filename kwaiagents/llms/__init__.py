@@ -1,9 +1,22 @@
 from __future__ import annotations
+import asyncio
 import time
 import traceback
 
-from kwaiagents.config import CFG
+from kwaiagents.config import get_cfg
+from kwaiagents.llms.cache import CompletionCache, get_completion_cache, is_cacheable
 from kwaiagents.llms.clients import OpenAIClient, FastChatClient
+from kwaiagents.llms.profiles import GenerationProfile, GENERATION_PROFILES, get_generation_profile
+from kwaiagents.llms.registry import LLM_CLIENTS, get_llm_client
+from kwaiagents.llms.retry import RetryPolicy, CircuitOpenError, NO_CIRCUIT_BREAKER, get_circuit_breaker, add_breaker_listener
+from kwaiagents.llms.sessions import get_http_session_stats
+from kwaiagents.llms.tokenizers import TOKENIZERS, get_tokenizer
+from kwaiagents.llms.usage import UsageTracker
+from kwaiagents.utils.budget import BudgetExceeded, SessionBudget
+from kwaiagents.utils.singleflight import SingleFlight
+
+
+LLM_FLIGHTS = SingleFlight()
 
 
 def create_chat_completion(
@@ -11,19 +24,92 @@ def create_chat_completion(
     history: list[tuple[str, str]] = list(),
     system: str = "",
     llm_model_name: str = "gpt-3.5-turbo",
-    temperature: float = CFG.temperature,
+    temperature: float = None,
     max_tokens: int = None,
     stop: str = "",
-    chat_id: str = None
+    chat_id: str = None,
+    session_id: str = None,
+    stream_callback=None,
+    retry_policy: RetryPolicy = None,
+    usage_tracker: UsageTracker = None,
+    stage: str = "",
+    generation_profile: str = None,
+    budget: SessionBudget = None,
+    tokenizer=None
 ) -> tuple[str, list[tuple[str, str]]]:
-    if CFG.use_local_llm:
-        llm_bot = FastChatClient(llm_model_name.lower(), host=CFG.local_llm_host, port=CFG.local_llm_port)
-    else:
-        llm_bot = OpenAIClient(llm_model_name.lower())
+    """Complete `query` with the backend of the current session config (see `session_config`).
+
+    The usage tracker defaults to the one of the session. Calls are only
+    bounded by a session budget passed as `budget`. Streamed completions come
+    without token counts, with a `tokenizer` they are estimated instead.
+    """
+    cfg = get_cfg()
+    usage_tracker = usage_tracker if usage_tracker is not None else cfg.usage_tracker
+    temperature, max_tokens, stop = resolve_generation_settings(
+        llm_model_name, generation_profile, temperature, max_tokens, stop)
+    if isinstance(query, list):
+        responses = create_batch_chat_completion(
+            queries=query,
+            system=system,
+            llm_model_name=llm_model_name,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stop=stop,
+            session_id=session_id,
+            retry_policy=retry_policy,
+            usage_tracker=usage_tracker,
+            stage=stage,
+            budget=budget
+        )
+        return responses, history
+
+    cache, cache_key = lookup_completion_cache(query, history, system, llm_model_name, temperature, max_tokens, stop)
+    if cache_key:
+        response = cache.get(cache_key)
+        if response is not None:
+            if stream_callback is not None:
+                stream_callback(response)
+            if usage_tracker is not None:
+                usage_tracker.record(stage, cached=True)
+            return response, history[:] + [[query, response]]
+
+    request = lambda: request_chat_completion(
+        query, history, system, llm_model_name, temperature, max_tokens, stop, chat_id, session_id,
+        stream_callback, retry_policy, usage_tracker, stage, cache, cache_key, budget, tokenizer)
+    if stream_callback is None and cfg.llm_singleflight:
+        # sessions on different backends never share a call
+        flight_key = (get_llm_client(llm_model_name, cfg).endpoint,
+            CompletionCache.make_key(llm_model_name, query, history, system, temperature, max_tokens, stop))
+        # a leader out of budget says nothing about the budget of the waiters
+        (response, new_history), leader = LLM_FLIGHTS.do(flight_key, request, timeout=cfg.llm_singleflight_timeout,
+            rerun_errors=(BudgetExceeded,))
+        if not leader and usage_tracker is not None:
+            usage_tracker.record(stage, cached=True)
+        return response, history[:] + [[query, response]]
+    return request()
+
+
+def request_chat_completion(query, history, system, llm_model_name, temperature, max_tokens, stop, chat_id, session_id,
+        stream_callback, retry_policy, usage_tracker, stage, cache, cache_key, budget=None, tokenizer=None):
+    cfg = get_cfg()
+    llm_bot = get_llm_client(llm_model_name, cfg)
+    policy = retry_policy if retry_policy else RetryPolicy.from_config(cfg)
+    breaker = get_client_breaker(llm_bot, cfg)
     response = None
-    num_retries = CFG.llm_max_retries
-    for attempt in range(num_retries):
-        backoff = 2 ** (attempt + 2)
+    usage = dict()
+    start_time = time.time()
+    # tokens already streamed to the caller can not be taken back, so a
+    # stream is never retried once it emitted anything
+    streamed = list()
+    on_token = None
+    if stream_callback is not None:
+        on_token = lambda token: (streamed.append(token), stream_callback(token))
+    for attempt in range(policy.max_retries):
+        if budget is not None:
+            budget.check()
+        breaker.before_call()
+        attempt_time = time.time()
+        usage = dict()
         try:
             response, new_history = llm_bot.chat(
                 query=query,
@@ -31,16 +117,289 @@ def create_chat_completion(
                 system=system,
                 temperature=temperature,
                 stop=stop,
-                chat_id=chat_id
+                max_tokens=max_tokens,
+                chat_id=chat_id,
+                session_id=session_id,
+                stream_callback=on_token,
+                usage=usage
             )
+        except Exception as err:
+            print(err)
+            if not policy.is_retryable(err):
+                breaker.release_trial()
+                raise
+            breaker.record_failure()
+            if streamed:
+                raise
+        except BaseException:
+            # cancelled or interrupted, the endpoint is neither up nor down
+            breaker.release_trial()
+            raise
+        else:
             if response and "omitted content" not in response.lower():
+                breaker.record_success()
+                break
+            # an empty completion is a failure of the endpoint as well
+            breaker.record_failure()
+            if streamed:
                 break
+            print("GPT Chat return empty string, Retrying...")
+        delay = policy.next_delay(attempt, start_time, budget.deadline if budget is not None else None)
+        if delay is None:
+            break
+        time.sleep(delay)
+    if not response:
+        raise RuntimeError(f"Failed to get response after {attempt + 1} attempts")
+
+    if not usage and tokenizer is not None:
+        usage = estimate_usage(tokenizer, query, history, system, response)
+    if usage_tracker is not None:
+        record_usage(usage_tracker, stage, usage, start_time, attempt_time, attempt)
+    if budget is not None:
+        budget.add_tokens(usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+    if cache_key and "omitted content" not in response.lower():
+        cache.set(cache_key, response)
+    return response, new_history
+
+
+def estimate_usage(tokenizer, query, history, system, response):
+    """Token counts of a call the server reported no usage for, e.g. a streamed one"""
+    prompt = system + "".join(str(q) + str(a) for q, a in history) + query
+    prompt_tokens = len(tokenizer.encode(prompt, add_special_tokens=False))
+    completion_tokens = len(tokenizer.encode(response, add_special_tokens=False))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "estimated": True
+    }
+
+
+def get_client_breaker(llm_bot, cfg):
+    """The circuit breaker of the endpoint of `llm_bot`.
+
+    The workers of an endpoint pool are ejected and re-admitted one by one by
+    the pool, a breaker over the whole pool would let one bad worker fail the
+    healthy ones.
+    """
+    if getattr(llm_bot, "pool", None) is not None:
+        return NO_CIRCUIT_BREAKER
+    return get_circuit_breaker(llm_bot.endpoint, cfg)
+
+
+def record_usage(usage_tracker, stage, usage, start_time, attempt_time, attempt):
+    usage_tracker.record(
+        stage,
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        queue_latency=attempt_time - start_time,
+        generation_latency=time.time() - attempt_time,
+        retries=attempt,
+        estimated=usage.get("estimated", False)
+    )
+
+
+def create_batch_chat_completion(
+    queries: list[str],
+    system: str = "",
+    llm_model_name: str = "gpt-3.5-turbo",
+    temperature: float = None,
+    max_tokens: int = None,
+    stop: str = "",
+    session_id: str = None,
+    retry_policy: RetryPolicy = None,
+    usage_tracker: UsageTracker = None,
+    stage: str = "",
+    generation_profile: str = None,
+    budget: SessionBudget = None
+) -> list[str]:
+    """Complete many independent single-turn queries with as few requests as possible.
+
+    Cached queries are answered from the cache, the rest are sent together and
+    only the ones that came back empty are sent again on retry.
+
+    Returns:
+        list[str]: The response of every query, "" for queries that still
+        failed after all retries.
+    """
+    if not queries:
+        return list()
+    cfg = get_cfg()
+    usage_tracker = usage_tracker if usage_tracker is not None else cfg.usage_tracker
+    temperature, max_tokens, stop = resolve_generation_settings(
+        llm_model_name, generation_profile, temperature, max_tokens, stop)
+    responses = [None] * len(queries)
+    cache_keys = [None] * len(queries)
+    for idx, query in enumerate(queries):
+        cache, cache_keys[idx] = lookup_completion_cache(query, list(), system, llm_model_name, temperature, max_tokens, stop)
+        if cache_keys[idx]:
+            responses[idx] = cache.get(cache_keys[idx])
+            if responses[idx] is not None and usage_tracker is not None:
+                usage_tracker.record(stage, cached=True)
+
+    llm_bot = get_llm_client(llm_model_name, cfg)
+    policy = retry_policy if retry_policy else RetryPolicy.from_config(cfg)
+    breaker = get_client_breaker(llm_bot, cfg)
+    usage = dict()
+    start_time = time.time()
+    attempt_time = start_time
+    for attempt in range(policy.max_retries):
+        pending = [idx for idx, response in enumerate(responses) if not response]
+        if not pending:
+            break
+        if budget is not None:
+            budget.check()
+        breaker.before_call()
+        attempt_time = time.time()
+        try:
+            batch_responses = llm_bot.batch_chat(
+                [queries[idx] for idx in pending],
+                system=system,
+                temperature=temperature,
+                stop=stop,
+                max_tokens=max_tokens,
+                session_id=session_id,
+                usage=usage
+            )
+        except Exception as err:
+            print(err)
+            if not policy.is_retryable(err):
+                breaker.release_trial()
+                raise
+            breaker.record_failure()
+        except BaseException:
+            # cancelled or interrupted, the endpoint is neither up nor down
+            breaker.release_trial()
+            raise
+        else:
+            answered = False
+            for idx, response in zip(pending, batch_responses):
+                if response and "omitted content" not in response.lower():
+                    responses[idx] = response
+                    answered = True
+                    if cache_keys[idx]:
+                        cache.set(cache_keys[idx], response)
+            if answered:
+                breaker.record_success()
             else:
-                raise RuntimeError("GPT Chat return empty string, Retrying...")
+                breaker.record_failure()
+            if all(responses):
+                break
+            print("GPT Chat return empty string, Retrying...")
+        delay = policy.next_delay(attempt, start_time, budget.deadline if budget is not None else None)
+        if delay is None:
+            break
+        time.sleep(delay)
+    if not any(responses):
+        raise RuntimeError(f"Failed to get response after {attempt + 1} attempts")
+
+    if usage_tracker is not None and usage:
+        record_usage(usage_tracker, stage, usage, start_time, attempt_time, attempt)
+    if budget is not None:
+        budget.add_tokens(usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+    return [response if response else "" for response in responses]
+
+
+def resolve_generation_settings(llm_model_name, generation_profile, temperature, max_tokens, stop, use_async=False):
+    """Fill the settings the caller left unset from the stage profile and the backend defaults"""
+    if generation_profile:
+        profile = get_generation_profile(generation_profile, get_cfg())
+        temperature = temperature if temperature is not None else profile.temperature
+        max_tokens = max_tokens if max_tokens else profile.max_tokens
+        stop = stop if stop else profile.stop
+    if temperature is None:
+        temperature = get_llm_client(llm_model_name, get_cfg(), use_async=use_async).default_temperature
+    return temperature, max_tokens, stop
+
+
+def lookup_completion_cache(query, history, system, llm_model_name, temperature, max_tokens, stop):
+    cfg = get_cfg()
+    cache = get_completion_cache(cfg)
+    if cache is None or not is_cacheable(temperature, cfg):
+        return cache, None
+    return cache, CompletionCache.make_key(llm_model_name, query, history, system, temperature, max_tokens, stop)
+
+
+async def acreate_chat_completion(
+    query: str,
+    history: list[tuple[str, str]] = list(),
+    system: str = "",
+    llm_model_name: str = "gpt-3.5-turbo",
+    temperature: float = None,
+    max_tokens: int = None,
+    stop: str = "",
+    chat_id: str = None,
+    session_id: str = None,
+    retry_policy: RetryPolicy = None,
+    usage_tracker: UsageTracker = None,
+    stage: str = "",
+    generation_profile: str = None,
+    budget: SessionBudget = None
+) -> tuple[str, list[tuple[str, str]]]:
+    cfg = get_cfg()
+    usage_tracker = usage_tracker if usage_tracker is not None else cfg.usage_tracker
+    temperature, max_tokens, stop = resolve_generation_settings(
+        llm_model_name, generation_profile, temperature, max_tokens, stop, use_async=True)
+    cache, cache_key = lookup_completion_cache(query, history, system, llm_model_name, temperature, max_tokens, stop)
+    if cache_key:
+        response = cache.get(cache_key)
+        if response is not None:
+            if usage_tracker is not None:
+                usage_tracker.record(stage, cached=True)
+            return response, history[:] + [[query, response]]
+
+    llm_bot = get_llm_client(llm_model_name, cfg, use_async=True)
+    policy = retry_policy if retry_policy else RetryPolicy.from_config(cfg)
+    breaker = get_client_breaker(llm_bot, cfg)
+    response = None
+    usage = dict()
+    start_time = time.time()
+    for attempt in range(policy.max_retries):
+        if budget is not None:
+            budget.check()
+        breaker.before_call()
+        attempt_time = time.time()
+        usage = dict()
+        try:
+            response, new_history = await llm_bot.achat(
+                query=query,
+                history=history,
+                system=system,
+                temperature=temperature,
+                stop=stop,
+                max_tokens=max_tokens,
+                chat_id=chat_id,
+                session_id=session_id,
+                usage=usage
+            )
         except Exception as err:
             print(err)
-        time.sleep(backoff)
+            if not policy.is_retryable(err):
+                breaker.release_trial()
+                raise
+            breaker.record_failure()
+        except BaseException:
+            # cancelled or interrupted, the endpoint is neither up nor down
+            breaker.release_trial()
+            raise
+        else:
+            if response and "omitted content" not in response.lower():
+                breaker.record_success()
+                break
+            # an empty completion is a failure of the endpoint as well
+            breaker.record_failure()
+            print("GPT Chat return empty string, Retrying...")
+        delay = policy.next_delay(attempt, start_time, budget.deadline if budget is not None else None)
+        if delay is None:
+            break
+        await asyncio.sleep(delay)
     if not response:
-        raise RuntimeError(f"Failed to get response after {num_retries} retries")
+        raise RuntimeError(f"Failed to get response after {attempt + 1} attempts")
 
-    return response, new_history
\ No newline at end of file
+    if usage_tracker is not None:
+        record_usage(usage_tracker, stage, usage, start_time, attempt_time, attempt)
+    if budget is not None:
+        budget.add_tokens(usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+    if cache_key and "omitted content" not in response.lower():
+        cache.set(cache_key, response)
+    return response, new_history
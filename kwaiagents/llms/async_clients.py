@@ -0,0 +1,65 @@
+import asyncio
+import weakref
+
+import aiohttp
+import openai
+
+from kwaiagents.config import get_cfg
+from kwaiagents.llms.clients import OpenAIClient, FastChatClient, make_gpt_messages, update_usage
+
+
+# event loop -> pool maxsize -> session
+_aiohttp_sessions = weakref.WeakKeyDictionary()
+
+
+def get_aiohttp_session(cfg=None):
+    """Return the keep-alive aiohttp session of the running event loop with the pool size of `cfg`."""
+    cfg = cfg if cfg else get_cfg()
+    sessions = _aiohttp_sessions.setdefault(asyncio.get_running_loop(), dict())
+    session = sessions.get(cfg.llm_pool_maxsize)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=cfg.llm_pool_maxsize, keepalive_timeout=60)
+        session = aiohttp.ClientSession(connector=connector, timeout=get_aiohttp_timeout(cfg))
+        sessions[cfg.llm_pool_maxsize] = session
+    return session
+
+
+def get_aiohttp_timeout(cfg):
+    return aiohttp.ClientTimeout(sock_connect=cfg.llm_connect_timeout, sock_read=cfg.llm_read_timeout)
+
+
+async def close_aiohttp_session():
+    sessions = _aiohttp_sessions.pop(asyncio.get_running_loop(), dict())
+    for session in sessions.values():
+        if not session.closed:
+            await session.close()
+
+
+class AsyncOpenAIClient(OpenAIClient):
+    async def achat(self, query, history=list(), system="", temperature=None, stop="", max_tokens=None, *args, **kwargs):
+        msgs = make_gpt_messages(query, system, history)
+
+        response = await openai.ChatCompletion.acreate(
+            messages=msgs,
+            **self.request_kwargs(temperature, max_tokens, stop)
+        )
+        response_text = response['choices'][0]['message']['content'] or ""
+        update_usage(kwargs.get("usage"), response)
+
+        new_history = history[:] + [[query, response_text]]
+        return response_text, new_history
+
+
+class AsyncFastChatClient(FastChatClient):
+    async def achat(self, query, history=list(), system="", temperature=None, stop="", max_tokens=None, *args, **kwargs):
+        data = self.make_request_data(query, system, history, temperature, max_tokens, stop)
+        cfg = get_cfg()
+        with self.route(kwargs.get("session_id")) as url:
+            async with get_aiohttp_session(cfg).post(url, json=data, headers=self.headers, timeout=get_aiohttp_timeout(cfg)) as resp:
+                resp.raise_for_status()
+                response = await resp.json(content_type=None)
+        update_usage(kwargs.get("usage"), response)
+        response_text = response['choices'][0]['text']
+
+        new_history = history[:] + [[query, response_text]]
+        return response_text, new_history
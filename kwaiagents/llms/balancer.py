@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from kwaiagents.config import CFG
+from kwaiagents.llms.sessions import get_http_session
+
+
+logger = logging.getLogger(__name__)
+
+
+class NoHealthyEndpointError(RuntimeError):
+    pass
+
+
+class Endpoint(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = int(port)
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.total_requests = 0
+
+    @classmethod
+    def from_string(cls, address):
+        address = address.replace("http://", "").rstrip("/")
+        host, port = address.rsplit(":", 1)
+        return cls(host, port)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+
+class EndpointPool(object):
+    """Route requests of one model over several FastChat workers.
+
+    Each request goes to the healthy endpoint with the fewest outstanding
+    requests. An endpoint is ejected after `max_failures` consecutive failures
+    and re-admitted by the background health check once it answers again.
+    With `sticky` set, all calls of a session stay on one endpoint while it is
+    healthy, so that the worker can reuse the KV cache of the shared prompt prefix.
+    Only the `max_sessions` most recently routed sessions are remembered.
+    """
+    def __init__(self, model, endpoints, sticky=False, max_failures=3, health_check_interval=10.0, max_sessions=10000):
+        self.model = model
+        self.endpoints = [Endpoint.from_string(e) if isinstance(e, str) else e for e in endpoints]
+        self.sticky = sticky
+        self.max_failures = max_failures
+        self.health_check_interval = health_check_interval
+        self.max_sessions = max_sessions
+        self.session_endpoints = OrderedDict()
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def name(self):
+        return f"pool:{self.model}"
+
+    def acquire(self, session_id=None):
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy]
+            if not healthy:
+                raise NoHealthyEndpointError(f"No healthy endpoint for {self.model}")
+            endpoint = None
+            if self.sticky and session_id:
+                endpoint = self.session_endpoints.get(session_id)
+                if endpoint is not None and not endpoint.healthy:
+                    endpoint = None
+            if endpoint is None:
+                endpoint = min(healthy, key=lambda e: (e.outstanding, e.total_requests))
+            if self.sticky and session_id:
+                self.session_endpoints[session_id] = endpoint
+                self.session_endpoints.move_to_end(session_id)
+                while len(self.session_endpoints) > self.max_sessions:
+                    self.session_endpoints.popitem(last=False)
+            endpoint.outstanding += 1
+            endpoint.total_requests += 1
+        self.start_health_checks()
+        return endpoint
+
+    def release(self, endpoint, success=True):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success:
+                endpoint.failures = 0
+                return
+            endpoint.failures += 1
+            if endpoint.healthy and endpoint.failures >= self.max_failures:
+                self._set_health(endpoint, False)
+
+    @contextmanager
+    def route(self, session_id=None):
+        endpoint = self.acquire(session_id)
+        success = False
+        try:
+            yield endpoint
+            success = True
+        finally:
+            self.release(endpoint, success)
+
+    def forget_session(self, session_id):
+        with self._lock:
+            self.session_endpoints.pop(session_id, None)
+
+    def _set_health(self, endpoint, healthy):
+        endpoint.healthy = healthy
+        endpoint.failures = 0
+        if healthy:
+            logger.warning("llm endpoint re-admitted: model=%s endpoint=%s", self.model, endpoint)
+        else:
+            logger.warning("llm endpoint ejected: model=%s endpoint=%s", self.model, endpoint)
+            self.session_endpoints = OrderedDict(
+                (k, v) for k, v in self.session_endpoints.items() if v is not endpoint)
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            try:
+                resp = get_http_session().get(f"{endpoint.base_url}/v1/models", timeout=2)
+                ok = resp.status_code == 200
+            except Exception:
+                ok = False
+            with self._lock:
+                if ok != endpoint.healthy:
+                    self._set_health(endpoint, ok)
+
+    def start_health_checks(self):
+        if self._health_thread is not None or not self.health_check_interval:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_check_interval):
+            self.check_health()
+
+    def stop(self):
+        self._stopped.set()
+
+    def get_stats(self):
+        with self._lock:
+            return [{
+                "endpoint": str(e),
+                "healthy": e.healthy,
+                "outstanding": e.outstanding,
+                "total_requests": e.total_requests
+            } for e in self.endpoints]
+
+
+_pools = dict()
+_pools_lock = threading.Lock()
+
+
+def get_endpoint_pool(model, cfg=CFG):
+    """Return the shared pool of `model`, or None when it has no endpoint list configured"""
+    endpoints = cfg.local_llm_endpoints.get(model.lower())
+    if not endpoints:
+        return None
+    key = (model.lower(), tuple(endpoints))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = EndpointPool(
+                    model.lower(),
+                    endpoints,
+                    sticky=cfg.llm_sticky_sessions,
+                    max_failures=cfg.llm_endpoint_max_failures,
+                    health_check_interval=cfg.llm_health_check_interval,
+                    max_sessions=cfg.llm_sticky_max_sessions
+                )
+                _pools[key] = pool
+    return pool
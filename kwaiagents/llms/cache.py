@@ -0,0 +1,187 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import time
+
+from kwaiagents.config import CFG
+
+
+class CompletionCache(object):
+    """Content-addressed cache of LLM responses.
+
+    An in-memory LRU sits in front of an on-disk store of one json file per
+    key, with no `cache_dir` the cache lives in memory only. Entries expire
+    after `ttl` seconds (None never expires) unless they were stored with a
+    ttl of their own, the memory level is bounded by entry count and the
+    disk level by total bytes.
+    """
+    def __init__(self, cache_dir="", max_memory_entries=1024, max_disk_bytes=512 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(llm_model_name, query, history, system, temperature, max_tokens, stop):
+        payload = json.dumps({
+            "model": llm_model_name.lower(),
+            "query": query,
+            "history": history,
+            "system": system,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stop": stop
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _expired(self, entry):
+        ttl = entry.get("ttl", self.ttl)
+        return ttl is not None and time.time() - entry["time"] > ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry):
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return entry["response"]
+            if entry is not None:
+                del self._memory[key]
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+            self._put_memory(key, entry)
+        return entry["response"]
+
+    def set(self, key, response, ttl=None):
+        """Store `response`, expiring after `ttl` seconds instead of the cache default when given"""
+        entry = {"time": time.time(), "response": response}
+        if ttl is not None:
+            entry["ttl"] = ttl
+        with self._lock:
+            self._put_memory(key, entry)
+            self.stats["writes"] += 1
+        self._write_disk(key, entry)
+
+    def _put_memory(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        if self._disk_bytes is None:
+            self._evict_disk()
+        else:
+            self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        files = list()
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        self._disk_bytes = total
+        if total <= self.max_disk_bytes:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.stats["evictions"] += 1
+            if total <= self.max_disk_bytes:
+                break
+        self._disk_bytes = total
+
+    def clear(self):
+        with self._lock:
+            self._memory = OrderedDict()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self._memory)
+        return stats
+
+
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache(cfg=CFG):
+    """Return the process-wide completion cache, or None when it is disabled"""
+    global _completion_cache
+    if not cfg.llm_cache_enabled:
+        return None
+    if _completion_cache is None:
+        with _completion_cache_lock:
+            if _completion_cache is None:
+                _completion_cache = CompletionCache(
+                    cache_dir=cfg.llm_cache_dir,
+                    max_memory_entries=cfg.llm_cache_max_memory_entries,
+                    max_disk_bytes=cfg.llm_cache_max_disk_bytes,
+                    ttl=cfg.llm_cache_ttl
+                )
+    return _completion_cache
+
+
+def is_cacheable(temperature, cfg=CFG):
+    return temperature is not None and temperature <= cfg.llm_cache_max_temperature
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+import json
 import logging
 import os
 import requests
@@ -7,6 +9,9 @@ import traceback
 
 import openai
 
+from kwaiagents.config import get_cfg
+from kwaiagents.llms.sessions import get_http_session, get_http_timeout
+
 
 def make_gpt_messages(query, system, history):
     msgs = list()
@@ -31,73 +36,231 @@ def make_gpt_messages(query, system, history):
     return msgs
 
 
+FATAL_OPENAI_ERRORS = (
+    openai.error.AuthenticationError,
+    openai.error.PermissionError,
+    openai.error.InvalidRequestError,
+)
+
+
+def parse_stream_line(line):
+    """Parse one server-sent event line of a streamed completion.
+
+    Returns:
+        str: The text delta of the line, "" for keep-alive or non-data lines
+        and None once the stream is done.
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return ""
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return None
+    chunk = json.loads(payload)
+    if not chunk.get("choices"):
+        return ""
+    choice = chunk["choices"][0]
+    if "text" in choice:
+        return choice["text"] or ""
+    return choice.get("delta", {}).get("content") or ""
+
+
+def update_usage(usage, response):
+    """Add the `usage` block of a server response to the `usage` dict of the caller"""
+    if usage is None or not response.get("usage"):
+        return
+    for key in ["prompt_tokens", "completion_tokens", "total_tokens"]:
+        usage[key] = usage.get(key, 0) + (response["usage"].get(key) or 0)
+
+
+def consume_stream(tokens, query, history, stream_callback):
+    response_text = ""
+    for token in tokens:
+        response_text += token
+        stream_callback(token)
+    new_history = history[:] + [[query, response_text]]
+    return response_text, new_history
+
+
 class OpenAIClient(object):
-    def __init__(self, model="gpt-3.5-turbo"):
+    @property
+    def default_temperature(self):
+        return get_cfg().temperature
+
+    def __init__(self, model="gpt-3.5-turbo", api_type=None, api_key=None, api_base=None, api_version=None):
         self.model = model
-        openai.api_type = os.environ.get("OPENAI_API_TYPE", "open_ai")
-        openai.api_key = os.environ["OPENAI_API_KEY"]
-        if openai.api_type == "azure":
-            openai.api_version = os.environ["OPENAI_API_VERSION"]
-            openai.api_base = os.environ["OPENAI_API_BASE"]
+        self.api_type = api_type if api_type else os.environ.get("OPENAI_API_TYPE", "open_ai")
+        self.api_key = api_key if api_key else os.environ["OPENAI_API_KEY"]
+        self.api_base = api_base
+        self.api_version = api_version
+        if self.api_type == "azure":
+            self.api_base = api_base if api_base else os.environ["OPENAI_API_BASE"]
+            self.api_version = api_version if api_version else os.environ["OPENAI_API_VERSION"]
+
+    @property
+    def endpoint(self):
+        return self.api_base if self.api_base else self.api_type
+
+    def request_kwargs(self, temperature=None, max_tokens=None, stop=None):
+        kwargs = {
+            "api_type": self.api_type,
+            "api_key": self.api_key,
+            "temperature": temperature if temperature is not None else self.default_temperature,
+        }
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        if stop:
+            kwargs["stop"] = stop
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        if self.api_version:
+            kwargs["api_version"] = self.api_version
+        if self.api_type == "azure":
+            kwargs["engine"] = self.model
+        else:
+            kwargs["model"] = self.model
+        return kwargs
+
+    def chat(self, query, history=list(), system="", temperature=None, stop="", max_tokens=None, stream_callback=None, *args, **kwargs):
+        if stream_callback is not None:
+            return consume_stream(self.stream_chat(query, history, system, temperature, stop, max_tokens), query, history, stream_callback)
 
-    def chat(self, query, history=list(), system="", temperature=0.0, stop="", *args, **kwargs):
         msgs = make_gpt_messages(query, system, history)
 
-        try:
-            if openai.api_type == "open_ai":
-                response = openai.ChatCompletion.create(
-                    model=self.model,
-                    messages=msgs,
-                    temperature = temperature,
-                    stop=stop
-                    )
-            elif openai.api_type == "azure":
-                response = openai.ChatCompletion.create(
-                    engine = self.model,
-                    messages=msgs,
-                    temperature = temperature,
-                    stop=stop
-                )
-            response_text = response['choices'][0]['message']['content']
-        except:
-            print(traceback.format_exc())
-            response_text = ""
+        # errors are raised for the retry policy to tell transient from fatal ones
+        response = openai.ChatCompletion.create(
+            messages=msgs,
+            **self.request_kwargs(temperature, max_tokens, stop)
+        )
+        response_text = response['choices'][0]['message']['content'] or ""
+        update_usage(kwargs.get("usage"), response)
 
         new_history = history[:] + [[query, response_text]]
         return response_text, new_history
 
+    def batch_chat(self, queries, system="", temperature=None, stop="", max_tokens=None, *args, **kwargs):
+        """Chat models take one conversation per request, so queries are sent one by one"""
+        return [self.chat(query, system=system, temperature=temperature, stop=stop, max_tokens=max_tokens, usage=kwargs.get("usage"))[0]
+            for query in queries]
+
+    def stream_chat(self, query, history=list(), system="", temperature=None, stop="", max_tokens=None):
+        msgs = make_gpt_messages(query, system, history)
+        response = openai.ChatCompletion.create(
+            messages=msgs,
+            stream=True,
+            **self.request_kwargs(temperature, max_tokens, stop)
+        )
+        for chunk in response:
+            if not chunk['choices']:
+                continue
+            token = chunk['choices'][0].get('delta', {}).get('content')
+            if token:
+                yield token
+
 
 class FastChatClient(object):
-    def __init__(self, model="kagentlms_baichuan2_13b_mat", host="localhost", port=8888):
+    default_temperature = 0.1
+    default_max_tokens = 512
+
+    def __init__(self, model="kagentlms_baichuan2_13b_mat", host="localhost", port=8888, pool=None):
         self.model = model
         self.host = host
         self.port = port
+        self.pool = pool
+
+    @property
+    def endpoint(self):
+        if self.pool is not None:
+            return self.pool.name
+        return f"{self.host}:{self.port}"
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/v1/completions/'
 
-    def chat(self, query, history=list(), system="", temperature=0.0, stop="", *args, **kwargs):
-        url = f'http://{self.host}:{self.port}/v1/completions/'
+    @contextmanager
+    def route(self, session_id=None):
+        """Yield the completions url of the worker that should serve this request"""
+        if self.pool is None:
+            yield self.url
+            return
+        with self.pool.route(session_id) as endpoint:
+            yield f'{endpoint.base_url}/v1/completions/'
 
-        headers = {"Content-Type": "application/json"}
+    @property
+    def headers(self):
+        return {"Content-Type": "application/json"}
+
+    def make_model_prompt(self, query, system, history):
         if "baichuan" in self.model:
-            prompt = self.make_baichuan_prompt(query, system, history)
+            return self.make_baichuan_prompt(query, system, history)
         elif "qwen" in self.model:
-            prompt = self.make_qwen_prompt(query, system, history)
+            return self.make_qwen_prompt(query, system, history)
         else:
-            prompt = self.make_prompt(query, system, history)
+            return self.make_prompt(query, system, history)
+
+    def make_request_data(self, query, system, history, temperature=None, max_tokens=None, stop=None):
         data = {
             "model": self.model,
-            "prompt": prompt,
-            "temperature": 0.1,
+            "prompt": self.make_model_prompt(query, system, history),
+            "temperature": temperature if temperature is not None else self.default_temperature,
             "top_p": 0.75,
             "top_k": 40,
-            "max_tokens": 512
+            "max_tokens": max_tokens if max_tokens else self.default_max_tokens
         }
-        resp = requests.post(url=url, json=data, headers=headers)
-        response = resp.json() # Check the JSON Response Content documentation below
+        if stop:
+            data["stop"] = stop
+        return data
+
+    def chat(self, query, history=list(), system="", temperature=None, stop="", max_tokens=None, stream_callback=None, *args, **kwargs):
+        if stream_callback is not None:
+            tokens = self.stream_chat(query, history, system, temperature, stop, max_tokens, kwargs.get("session_id"))
+            return consume_stream(tokens, query, history, stream_callback)
+
+        data = self.make_request_data(query, system, history, temperature, max_tokens, stop)
+        with self.route(kwargs.get("session_id")) as url:
+            resp = get_http_session(get_cfg()).post(url=url, json=data, headers=self.headers, timeout=get_http_timeout(get_cfg()))
+            resp.raise_for_status()
+            response = resp.json() # Check the JSON Response Content documentation below
+        update_usage(kwargs.get("usage"), response)
         response_text = response['choices'][0]['text']
 
         new_history = history[:] + [[query, response_text]]
         return response_text, new_history
 
+    def batch_chat(self, queries, system="", temperature=None, stop="", max_tokens=None, *args, **kwargs):
+        """Send many prompts in one `/v1/completions` request.
+
+        Returns:
+            list[str]: The response of every query, in the order of `queries`.
+        """
+        data = self.make_request_data(queries[0], system, list(), temperature, max_tokens, stop)
+        data["prompt"] = [self.make_model_prompt(query, system, list()) for query in queries]
+        with self.route(kwargs.get("session_id")) as url:
+            resp = get_http_session(get_cfg()).post(url=url, json=data, headers=self.headers, timeout=get_http_timeout(get_cfg()))
+            resp.raise_for_status()
+            response = resp.json()
+        update_usage(kwargs.get("usage"), response)
+        response_texts = [""] * len(queries)
+        for idx, choice in enumerate(response['choices']):
+            response_texts[choice.get('index', idx)] = choice['text']
+        return response_texts
+
+    def stream_chat(self, query, history=list(), system="", temperature=None, stop="", max_tokens=None, session_id=None):
+        data = self.make_request_data(query, system, history, temperature, max_tokens, stop)
+        data["stream"] = True
+        with self.route(session_id) as url, \
+                get_http_session(get_cfg()).post(url=url, json=data, headers=self.headers, timeout=get_http_timeout(get_cfg()), stream=True) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines(chunk_size=None):
+                token = parse_stream_line(line)
+                if token is None:
+                    break
+                if token:
+                    yield token
+
     @staticmethod
     def make_prompt(query, system, history):
         if not history:
@@ -0,0 +1,44 @@
+from kwaiagents.config import CFG
+
+
+class GenerationProfile(object):
+    """Generation settings of one agent stage.
+
+    Args:
+        max_tokens (int): Maximum number of generated tokens.
+        stop (list[str]): Stop sequences, generation ends once one is produced.
+        temperature (float): Sampling temperature, None for the backend default.
+    """
+    def __init__(self, max_tokens=None, stop=None, temperature=None):
+        self.max_tokens = max_tokens
+        self.stop = stop if stop else list()
+        self.temperature = temperature
+
+    def __repr__(self):
+        return f"GenerationProfile(max_tokens={self.max_tokens}, stop={self.stop}, temperature={self.temperature})"
+
+
+# The planning task is a pretty printed json object, whose closing brace is the
+# only one at the start of a line. The stop sequence drops that brace, which
+# `find_json_dict` puts back before parsing.
+GENERATION_PROFILES = {
+    "planning": GenerationProfile(max_tokens=384, stop=["\n}"]),
+    "multi_planning": GenerationProfile(max_tokens=768),
+    "chunk_summary": GenerationProfile(max_tokens=300),
+    "reduce_summary": GenerationProfile(max_tokens=400),
+    "memory_summary": GenerationProfile(max_tokens=256),
+    "conclusion": GenerationProfile(max_tokens=1024),
+}
+
+
+def get_generation_profile(name, cfg=CFG):
+    """Return the profile `name` with the overrides of `cfg.generation_profiles` applied"""
+    profile = GENERATION_PROFILES.get(name, GenerationProfile())
+    overrides = cfg.generation_profiles.get(name)
+    if not overrides:
+        return profile
+    return GenerationProfile(
+        max_tokens=overrides.get("max_tokens", profile.max_tokens),
+        stop=overrides.get("stop", profile.stop),
+        temperature=overrides.get("temperature", profile.temperature)
+    )
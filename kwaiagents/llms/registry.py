@@ -0,0 +1,67 @@
+import threading
+
+from kwaiagents.llms.balancer import get_endpoint_pool
+from kwaiagents.llms.clients import OpenAIClient, FastChatClient
+
+
+class LLMClientRegistry(object):
+    """Thread-safe registry of long-lived LLM clients.
+
+    Clients are keyed by (backend, model, host, port) and built once, so that
+    concurrent sessions share warm clients instead of constructing new ones
+    for every completion.
+    """
+    def __init__(self):
+        self._clients = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(backend, model, host=None, port=None):
+        return (backend, model.lower(), host, port)
+
+    def get(self, backend, model, host=None, port=None, pool=None):
+        key = self.make_key(backend, model, host, port)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.build(backend, model.lower(), host, port, pool)
+                self._clients[key] = client
+        return client
+
+    @staticmethod
+    def build(backend, model, host=None, port=None, pool=None):
+        if backend == "fastchat":
+            return FastChatClient(model, host=host, port=port, pool=pool)
+        elif backend == "openai":
+            return OpenAIClient(model)
+        elif backend == "fastchat_async":
+            from kwaiagents.llms.async_clients import AsyncFastChatClient
+            return AsyncFastChatClient(model, host=host, port=port, pool=pool)
+        elif backend == "openai_async":
+            from kwaiagents.llms.async_clients import AsyncOpenAIClient
+            return AsyncOpenAIClient(model)
+        else:
+            raise ValueError(f"Unknown llm backend: {backend}")
+
+    def clear(self):
+        with self._lock:
+            self._clients = dict()
+
+    def __len__(self):
+        return len(self._clients)
+
+
+LLM_CLIENTS = LLMClientRegistry()
+
+
+def get_llm_client(model, cfg, use_async=False):
+    suffix = "_async" if use_async else ""
+    if cfg.use_local_llm:
+        pool = get_endpoint_pool(model, cfg)
+        if pool is not None:
+            return LLM_CLIENTS.get("fastchat" + suffix, model, pool.name, id(pool), pool=pool)
+        return LLM_CLIENTS.get("fastchat" + suffix, model, cfg.local_llm_host, cfg.local_llm_port)
+    return LLM_CLIENTS.get("openai" + suffix, model)
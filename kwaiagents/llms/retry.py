@@ -0,0 +1,188 @@
+import logging
+import random
+import threading
+import time
+
+import aiohttp
+import requests
+
+from kwaiagents.config import CFG
+from kwaiagents.llms.clients import FATAL_OPENAI_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class RetryPolicy(object):
+    """Jittered exponential backoff bounded by an overall deadline.
+
+    Args:
+        max_retries (int): Maximum number of attempts.
+        base_delay (float): Backoff of the first retry in seconds.
+        max_delay (float): Upper bound of a single backoff in seconds.
+        deadline (float): Overall time budget of one completion in seconds, None for no limit.
+    """
+    fatal_errors = FATAL_OPENAI_ERRORS
+
+    def __init__(self, max_retries=5, base_delay=1.0, max_delay=16.0, deadline=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    @classmethod
+    def from_config(cls, cfg=CFG):
+        return cls(
+            max_retries=cfg.llm_max_retries,
+            base_delay=cfg.llm_retry_base_delay,
+            max_delay=cfg.llm_retry_max_delay,
+            deadline=cfg.llm_retry_deadline
+        )
+
+    def is_retryable(self, err):
+        if isinstance(err, CircuitOpenError):
+            return False
+        if isinstance(err, requests.HTTPError) and err.response is not None:
+            status = err.response.status_code
+            return status == 429 or status >= 500
+        if isinstance(err, aiohttp.ClientResponseError):
+            return err.status == 429 or err.status >= 500
+        if isinstance(err, self.fatal_errors):
+            return False
+        return True
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, attempt, start_time, session_deadline=None):
+        """Return the sleep before the next attempt, or None when no attempt is left.
+
+        `session_deadline` is the timestamp the whole session has to end by.
+        """
+        if attempt + 1 >= self.max_retries:
+            return None
+        delay = self.backoff(attempt)
+        if self.deadline is not None and time.time() + delay - start_time >= self.deadline:
+            return None
+        if session_deadline is not None and time.time() + delay >= session_deadline:
+            return None
+        return delay
+
+
+class CircuitBreaker(object):
+    """Fail fast while an endpoint is down.
+
+    The breaker opens after `failure_threshold` consecutive failures. Once
+    `reset_timeout` seconds have passed it lets a single trial call through
+    (half open), and closes again when that call succeeds.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.stats = {"opened": 0, "closed": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(f"Circuit of {self.endpoint} is open, failing fast")
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(f"Circuit of {self.endpoint} is half open, failing fast")
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def release_trial(self):
+        """End a call without an outcome for the endpoint, e.g. a rejected request or a cancelled call.
+
+        A half-open breaker then lets the next call through as its trial.
+        """
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or \
+                    (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.time()
+                self._transition(self.OPEN)
+
+    def _transition(self, state):
+        self.state = state
+        self.stats["opened" if state == self.OPEN else "closed"] += 1
+        logger.warning("llm circuit %s: endpoint=%s failures=%d stats=%s",
+            state, self.endpoint, self.failures, self.stats)
+        for listener in list(BREAKER_LISTENERS):
+            try:
+                listener(self.endpoint, state, dict(self.stats))
+            except Exception:
+                logger.exception("circuit breaker listener failed")
+
+
+class NoCircuitBreaker(object):
+    """Stands in for the breaker of endpoints that are failed over elsewhere, e.g. by an `EndpointPool`"""
+    state = CircuitBreaker.CLOSED
+
+    def before_call(self):
+        pass
+
+    def release_trial(self):
+        pass
+
+    def record_success(self):
+        pass
+
+    def record_failure(self):
+        pass
+
+
+BREAKER_LISTENERS = list()
+NO_CIRCUIT_BREAKER = NoCircuitBreaker()
+_breakers = dict()
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint, cfg=CFG):
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint,
+                    failure_threshold=cfg.llm_breaker_failure_threshold,
+                    reset_timeout=cfg.llm_breaker_reset_timeout
+                )
+                _breakers[endpoint] = breaker
+    return breaker
+
+
+def add_breaker_listener(listener):
+    """Register `listener(endpoint, state, stats)`, called when a breaker opens or closes"""
+    BREAKER_LISTENERS.append(listener)
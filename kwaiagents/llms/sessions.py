@@ -0,0 +1,113 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from kwaiagents.config import CFG
+
+
+# (pool connections, pool maxsize) -> session
+_http_sessions = dict()
+_http_session_lock = threading.Lock()
+_http_stats = {"requests": 0, "connections": 0}
+_http_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _http_stats_lock:
+        _http_stats[key] += 1
+
+
+# a keep-alive connection dropped by the server is reopened on the same
+# connection object, so new sockets are counted where they are opened
+class CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        _count("connections")
+        return super().connect()
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        _count("connections")
+        return super().connect()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+    def _make_request(self, *args, **kwargs):
+        _count("requests")
+        return super()._make_request(*args, **kwargs)
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+    def _make_request(self, *args, **kwargs):
+        _count("requests")
+        return super()._make_request(*args, **kwargs)
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools count the requests sent and the sockets opened"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool
+        }
+
+
+def get_http_session(cfg=CFG):
+    """Return the keep-alive session shared by the LLM clients with the pool settings of `cfg`.
+
+    Sessions are created lazily, one per distinct `llm_pool_connections` and
+    `llm_pool_maxsize`, later calls reuse them so that connections to the LLM
+    server stay warm. Timeouts are per request, see `get_http_timeout`.
+    """
+    key = (cfg.llm_pool_connections, cfg.llm_pool_maxsize)
+    session = _http_sessions.get(key)
+    if session is None:
+        with _http_session_lock:
+            session = _http_sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = CountingHTTPAdapter(
+                    pool_connections=cfg.llm_pool_connections,
+                    pool_maxsize=cfg.llm_pool_maxsize,
+                    max_retries=0
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _http_sessions[key] = session
+    return session
+
+
+def get_http_timeout(cfg=CFG):
+    return (cfg.llm_connect_timeout, cfg.llm_read_timeout)
+
+
+def get_http_session_stats():
+    """Count requests and new connections made through the shared sessions.
+
+    Returns:
+        dict: `requests`, `connections` (sockets opened, reconnects of a
+        dropped keep-alive connection included) and `reused` (requests served
+        by an already open connection).
+    """
+    with _http_stats_lock:
+        stats = dict(_http_stats)
+    stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+    return stats
+
+
+def close_http_session():
+    with _http_session_lock:
+        for session in _http_sessions.values():
+            session.close()
+        _http_sessions.clear()
+        with _http_stats_lock:
+            _http_stats.update(requests=0, connections=0)
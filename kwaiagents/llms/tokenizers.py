@@ -0,0 +1,132 @@
+from functools import lru_cache
+import threading
+import traceback
+
+from kwaiagents.config import CFG
+
+
+PARITY_TEXTS = [
+    "Hello world! How many days are there between 2023-01-01 and 2023-03-01?",
+    "今天北京的天气怎么样？请帮我查询一下，并给出穿衣建议。",
+    '{\n    "task_name": "search",\n    "command":{\n        "name":"web_search",\n        "args":{"text":"刘德华 老婆"}\n    }\n}',
+    "  leading spaces, tabs\tand\nnew lines\n\n  ",
+]
+
+
+def get_tokenizer_name(llm_name):
+    if "baichuan" in llm_name:
+        return "kwaikeg/kagentlms_baichuan2_13b_mat"
+    elif "qwen" in llm_name:
+        return "kwaikeg/kagentlms_qwen_7b_mat"
+    else:
+        return "gpt2"
+
+
+def load_tokenizer(model_name, use_fast):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(
+        model_name,
+        use_fast=use_fast,
+        padding_side='left',
+        trust_remote_code=True
+    )
+
+
+def check_parity(fast_tokenizer, slow_tokenizer, texts=PARITY_TEXTS):
+    """Whether the fast tokenizer encodes and decodes `texts` exactly like the slow one"""
+    for text in texts:
+        fast_ids = fast_tokenizer.encode(text, add_special_tokens=False)
+        if fast_ids != slow_tokenizer.encode(text, add_special_tokens=False):
+            return False
+        if fast_tokenizer.decode(fast_ids, skip_special_tokens=True) != \
+                slow_tokenizer.decode(fast_ids, skip_special_tokens=True):
+            return False
+    return True
+
+
+class CachedTokenizer(object):
+    """A tokenizer whose `encode` results are memoized.
+
+    Prompts are re-encoded on every planning iteration while most of their
+    text (profile, tools, memory) is unchanged, so encodings are kept in an
+    LRU keyed by text and arguments. Everything else is delegated to the
+    wrapped tokenizer.
+    """
+    def __init__(self, tokenizer, cache_size=1024):
+        self.tokenizer = tokenizer
+        self._encode = lru_cache(maxsize=cache_size)(self._encode_uncached)
+
+    def _encode_uncached(self, text, add_special_tokens):
+        return tuple(self.tokenizer.encode(text, add_special_tokens=add_special_tokens))
+
+    def encode(self, text, add_special_tokens=True, **kwargs):
+        if kwargs:
+            return self.tokenizer.encode(text, add_special_tokens=add_special_tokens, **kwargs)
+        return list(self._encode(text, add_special_tokens))
+
+    def count_tokens(self, text, add_special_tokens=False):
+        return len(self._encode(text, add_special_tokens))
+
+    def cache_info(self):
+        return self._encode.cache_info()
+
+    def __getattr__(self, name):
+        return getattr(self.tokenizer, name)
+
+
+class TokenizerRegistry(object):
+    """Thread-safe registry of tokenizers shared by every agent of the process.
+
+    Each tokenizer is loaded once, on first use. With `prefer_fast` the fast
+    (Rust) tokenizer is used when it matches the slow one on `PARITY_TEXTS`.
+    """
+    def __init__(self):
+        self._tokenizers = dict()
+        self._lock = threading.Lock()
+        self._loading_locks = dict()
+
+    def get(self, model_name, prefer_fast=True, cache_size=1024):
+        tokenizer = self._tokenizers.get(model_name)
+        if tokenizer is not None:
+            return tokenizer
+        with self._lock:
+            loading_lock = self._loading_locks.setdefault(model_name, threading.Lock())
+        # loading takes seconds, only callers of the same tokenizer wait for each other
+        with loading_lock:
+            tokenizer = self._tokenizers.get(model_name)
+            if tokenizer is None:
+                tokenizer = CachedTokenizer(self.build(model_name, prefer_fast), cache_size)
+                self._tokenizers[model_name] = tokenizer
+        return tokenizer
+
+    @staticmethod
+    def build(model_name, prefer_fast=True):
+        slow_tokenizer = load_tokenizer(model_name, use_fast=False)
+        if not prefer_fast:
+            return slow_tokenizer
+        try:
+            fast_tokenizer = load_tokenizer(model_name, use_fast=True)
+            if getattr(fast_tokenizer, "is_fast", False) and check_parity(fast_tokenizer, slow_tokenizer):
+                return fast_tokenizer
+            print(f"fast tokenizer of {model_name} is unavailable or differs from the slow one, using the slow one")
+        except:
+            print(traceback.format_exc())
+        return slow_tokenizer
+
+    def clear(self):
+        with self._lock:
+            self._tokenizers = dict()
+
+    def __len__(self):
+        return len(self._tokenizers)
+
+
+TOKENIZERS = TokenizerRegistry()
+
+
+def get_tokenizer(llm_name, cfg=CFG):
+    return TOKENIZERS.get(
+        get_tokenizer_name(llm_name),
+        prefer_fast=cfg.tokenizer_prefer_fast,
+        cache_size=cfg.tokenizer_encode_cache_size
+    )
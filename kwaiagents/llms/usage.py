@@ -0,0 +1,64 @@
+from collections import OrderedDict
+import threading
+
+
+USAGE_FIELDS = [
+    "calls", "cached_calls", "estimated_calls", "prompt_tokens", "completion_tokens", "total_tokens",
+    "queue_latency", "generation_latency", "retries"
+]
+
+
+class UsageTracker(object):
+    """Token and latency accounting of the LLM calls of one session.
+
+    Every call is recorded under a stage such as `auto_task_create`,
+    `auto_command_browse_website` or `auto_conclusion`. `queue_latency` is the
+    time spent before the successful attempt was sent (retries, backoff and
+    routing), `generation_latency` the duration of that attempt.
+    `estimated_calls` counts the calls whose tokens were counted with the
+    tokenizer because the server reported none, e.g. streamed ones.
+    """
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, stage, prompt_tokens=0, completion_tokens=0, queue_latency=0.0,
+            generation_latency=0.0, retries=0, cached=False, estimated=False):
+        stage = stage if stage else "other"
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = {key: 0 for key in USAGE_FIELDS}
+            usage = self.stages[stage]
+            usage["calls"] += 1
+            usage["cached_calls"] += int(cached)
+            usage["estimated_calls"] += int(estimated)
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+            usage["total_tokens"] += prompt_tokens + completion_tokens
+            usage["queue_latency"] += queue_latency
+            usage["generation_latency"] += generation_latency
+            usage["retries"] += retries
+
+    def total(self):
+        total = {key: 0 for key in USAGE_FIELDS}
+        with self._lock:
+            for usage in self.stages.values():
+                for key in USAGE_FIELDS:
+                    total[key] += usage[key]
+        return total
+
+    def to_dict(self):
+        with self._lock:
+            stages = {stage: dict(usage) for stage, usage in self.stages.items()}
+        for usage in stages.values():
+            usage["queue_latency"] = round(usage["queue_latency"], 3)
+            usage["generation_latency"] = round(usage["generation_latency"], 3)
+        total = self.total()
+        total["queue_latency"] = round(total["queue_latency"], 3)
+        total["generation_latency"] = round(total["generation_latency"], 3)
+        return {
+            "session_id": self.session_id,
+            "total": total,
+            "stages": stages
+        }
@@ -1,6 +1,8 @@
+from .cache import get_tool_cache, get_tool_cache_stats
+from .prefetch import PagePrefetcher, get_page_prefetcher, get_page_prefetch_stats
 from .commons import NoTool, NoToolResult, FinishTool, FinishResult
-from .search import SearchTool
-from .browser import BrowserTool
+from .search import SearchTool, SearchResult
+from .browser import BrowserTool, prefetch_pages
 from .weather import WeatherTool
 from .calendars import CalendarTool
 from .timedelta import TimeDeltaTool
@@ -9,4 +11,9 @@ from .solarterms import SolarTermsTool
 
 ALL_NO_TOOLS = [NoTool, FinishTool]
 ALL_AUTO_TOOLS = [SearchTool, BrowserTool, WeatherTool, CalendarTool, TimeDeltaTool, SolarTermsTool]
-ALL_TOOLS = [SearchTool, BrowserTool, WeatherTool, CalendarTool, TimeDeltaTool, SolarTermsTool]
\ No newline at end of file
+ALL_TOOLS = [SearchTool, BrowserTool, WeatherTool, CalendarTool, TimeDeltaTool, SolarTermsTool]
+
+
+from .registry import ThreadLocalTool, ToolRegistry
+
+TOOLS = ToolRegistry(ALL_TOOLS, ALL_NO_TOOLS)
\ No newline at end of file
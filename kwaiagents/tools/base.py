@@ -1,7 +1,19 @@
+import json
 import pprint
+import re
+
+from kwaiagents.config import get_cfg
+from kwaiagents.tools.cache import dump_result, get_tool_cache, load_result
+from kwaiagents.utils.budget import BudgetExceeded
+from kwaiagents.utils.singleflight import SingleFlight
+
+
+TOOL_FLIGHTS = SingleFlight()
 
 
 class BaseResult(object):
+    cached = False
+
     def __init__(self, json_data):
         self.json_data = json_data
 
@@ -25,9 +37,76 @@ class BaseResult(object):
         return list()
 
 
+def normalize_tool_args(kwargs):
+    """Strip and collapse the whitespace of string arguments so equivalent calls share a key"""
+    return {
+        key: re.sub(r"\s+", " ", val).strip() if isinstance(val, str) else val
+        for key, val in kwargs.items()
+    }
+
+
+def make_tool_call_key(tool_name, kwargs):
+    return tool_name + ":" + json.dumps(normalize_tool_args(kwargs), ensure_ascii=False, sort_keys=True, default=str)
+
+
 class BaseTool(object):
+    singleflight = True
+    singleflight_timeout = 120.0
+    # Seconds a result stays in the tool cache: 0 disables caching, None never expires
+    cache_ttl = 0
+    # Tools keeping state between calls get one instance per thread from the ToolRegistry
+    thread_local = False
+    # Tools that log or call LLMs get the cfg of the calling session as `cfg`
+    uses_session_cfg = False
+
     def __init__(self, *args, **kwargs):
         pass
 
     def __call__(self):
-        return BaseResult({})
\ No newline at end of file
+        return BaseResult({})
+
+    def get_cache_ttl(self, **kwargs):
+        """The cache ttl of a call, override when it depends on the arguments"""
+        return self.cache_ttl
+
+    def is_cacheable_result(self, result):
+        return bool(result.json_data)
+
+    def invoke(self, cfg=None, **kwargs):
+        """Call the tool, sharing one in-flight call among concurrent identical invocations.
+
+        Results of tools with a cache ttl are served from the tool cache, the
+        returned result then has `cached` set. `cfg` is the config of the
+        calling session, by default the one of the current context, and every
+        invocation counts against its session budget.
+        """
+        cfg = cfg if cfg is not None else get_cfg()
+        budget = cfg.session_budget
+        if budget is not None:
+            budget.start_tool_call()
+        key = make_tool_call_key(getattr(self, "name", type(self).__name__), kwargs)
+        ttl = self.get_cache_ttl(**kwargs)
+        cache = get_tool_cache(cfg) if ttl != 0 else None
+        if cache is not None:
+            entry = cache.get(key)
+            if entry is not None:
+                return load_result(entry)
+
+        if self.uses_session_cfg:
+            # the call logs to and spends the budget of its session, so it is only shared within the session
+            call = lambda: self(cfg=cfg, **kwargs)
+            flight_key = (key, id(cfg))
+        else:
+            call = lambda: self(**kwargs)
+            flight_key = key
+        if self.singleflight:
+            result, _ = TOOL_FLIGHTS.do(flight_key, call, timeout=self.singleflight_timeout,
+                rerun_errors=(BudgetExceeded,))
+        else:
+            result = call()
+
+        if cache is not None and self.is_cacheable_result(result):
+            entry = dump_result(result)
+            if entry is not None:
+                cache.set(key, entry, ttl=ttl)
+        return result
\ No newline at end of file
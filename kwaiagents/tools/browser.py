@@ -9,7 +9,8 @@ from kwaiagents.utils.html_utils import extract_hyperlinks, format_hyperlinks
 import kwaiagents.utils.nlp_utils as summary
 from kwaiagents.config import Config
 from kwaiagents.tools.base import BaseTool, BaseResult
-from kwaiagents.utils.selenium_utils import get_pagesource_with_selenium
+from kwaiagents.tools.prefetch import get_page_prefetcher
+from kwaiagents.utils.selenium_utils import get_pagesource_with_selenium, get_page_load_timeout
 
 FILE_DIR = Path(__file__).parent.parent
 
@@ -40,12 +41,14 @@ class BrowserTool(BaseTool):
     zh_name = "网页浏览器"
     description = "Browse Website:\"browse_website\",args:\"url\":\"<url>, \"question\":\"<what_you_want_to_find_on_website>\""
     tips = "Browse a specific website using the provided URL link. Recommended to use URLs from `web_search` to avoid invalid links."
+    singleflight_timeout = 300.0
+    uses_session_cfg = True
 
     def __init__(self, cfg=None, *args, **kwargs):
         self.cfg = cfg if cfg else Config()
 
-    def __call__(self, url, question="",  *args, **kwargs):
-        summary, urls, prompt_responses = browse_website(url, question, self.cfg)
+    def __call__(self, url, question="", cfg=None, *args, **kwargs):
+        summary, urls, prompt_responses = browse_website(url, question, cfg if cfg else self.cfg)
         return BrowseResult({
             "summary": summary,
             "urls": urls,
@@ -63,17 +66,29 @@ def browse_website(url: str, question: str, cfg: Config = None) -> tuple[str, We
     Returns:
         Tuple[str, WebDriver]: The answer and links to the user and the webdriver
     """
+    budget = getattr(cfg, "session_budget", None)
+    if budget is not None:
+        budget.start_browse_page()
     if cfg:
         cfg.chain_logger.put("click", f"Access the website {url} ")
-    driver, text = scrape_text_with_selenium(url, cfg)
-    add_header(driver)
-    summary_text, prompt_responses = summary.summarize_text(url, text, question, driver, cfg)
-    links = scrape_links_with_selenium(driver, url)
+    page = take_prefetched_page(url, cfg)
+    if page is not None:
+        driver = None
+        text, links = page
+    else:
+        driver, text = scrape_text_with_selenium(url, cfg)
+        links = None
+    try:
+        add_header(driver)
+        summary_text, prompt_responses = summary.summarize_text(url, text, question, driver, cfg)
+        if links is None:
+            links = scrape_links_with_selenium(driver, url)
+    finally:
+        close_browser(driver)
 
     # Limit links to 5
     if len(links) > 5:
         links = links[:5]
-    close_browser(driver)
     return summary_text, links, prompt_responses
 
 def scrape_text_with_selenium(url: str, cfg: Config = None) -> tuple[WebDriver, str]:
@@ -85,7 +100,12 @@ def scrape_text_with_selenium(url: str, cfg: Config = None) -> tuple[WebDriver,
     Returns:
         Tuple[WebDriver, str]: The webdriver and the text scraped from the website
     """
-    driver, page_source = get_pagesource_with_selenium(url, cfg.selenium_web_browser)
+    driver, page_source = get_pagesource_with_selenium(url, cfg.selenium_web_browser,
+        timeout=get_page_load_timeout(cfg, getattr(cfg, "session_budget", None)))
+    return driver, extract_page_text(page_source)
+
+
+def extract_page_text(page_source: str) -> str:
     soup = BeautifulSoup(page_source, "html.parser")
     for script in soup(["script", "style"]):
         script.extract()
@@ -94,7 +114,53 @@ def scrape_text_with_selenium(url: str, cfg: Config = None) -> tuple[WebDriver,
     lines = (line.strip() for line in text.splitlines())
     chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
     text = "\n".join(chunk for chunk in chunks if chunk)
-    return driver, text
+    return text
+
+
+def extract_page_links(page_source: str, url: str) -> list[str]:
+    soup = BeautifulSoup(page_source, "html.parser")
+
+    for script in soup(["script", "style"]):
+        script.extract()
+
+    hyperlinks = extract_hyperlinks(soup, url)
+
+    return format_hyperlinks(hyperlinks)
+
+
+def fetch_page(url: str, selenium_web_browser: str = "chrome", timeout: float = None) -> tuple[str, list[str]]:
+    """Load a website and return its text and links, the browser is closed right away
+
+    Args:
+        url (str): The url of the website to load
+        selenium_web_browser (str): The browser to load it with
+        timeout (float): The page load timeout in seconds
+
+    Returns:
+        Tuple[str, List[str]]: The text and the links of the website
+    """
+    driver, page_source = get_pagesource_with_selenium(url, selenium_web_browser, timeout=timeout)
+    try:
+        return extract_page_text(page_source), extract_page_links(page_source, url)
+    finally:
+        close_browser(driver)
+
+
+def prefetch_pages(urls: list[str], cfg: Config, session_id: str = None) -> None:
+    """Start loading `urls` in the background for a later `browse_website`, when `cfg.browse_prefetch` is on"""
+    prefetcher = get_page_prefetcher(cfg)
+    if prefetcher is None:
+        return
+    selenium_web_browser, timeout = cfg.selenium_web_browser, cfg.selenium_page_load_timeout
+    prefetcher.prefetch(urls, lambda url: fetch_page(url, selenium_web_browser, timeout), session_id)
+
+
+def take_prefetched_page(url: str, cfg: Config = None) -> tuple[str, list[str]]:
+    """The text and links of `url` if it was prefetched, None otherwise"""
+    prefetcher = get_page_prefetcher(cfg) if cfg else None
+    if prefetcher is None:
+        return None
+    return prefetcher.take(url, timeout=get_page_load_timeout(cfg, getattr(cfg, "session_budget", None)))
 
 
 def scrape_links_with_selenium(driver: WebDriver, url: str) -> list[str]:
@@ -108,15 +174,7 @@ def scrape_links_with_selenium(driver: WebDriver, url: str) -> list[str]:
     """
     if not driver:
         return list()
-    page_source = driver.page_source
-    soup = BeautifulSoup(page_source, "html.parser")
-
-    for script in soup(["script", "style"]):
-        script.extract()
-
-    hyperlinks = extract_hyperlinks(soup, url)
-
-    return format_hyperlinks(hyperlinks)
+    return extract_page_links(driver.page_source, url)
 
 
 def close_browser(driver: WebDriver) -> None:
@@ -0,0 +1,58 @@
+import importlib
+import json
+import threading
+
+from kwaiagents.config import CFG
+from kwaiagents.llms.cache import CompletionCache
+
+
+_tool_cache = None
+_tool_cache_lock = threading.Lock()
+
+
+def get_tool_cache(cfg=CFG):
+    """Return the process-wide tool result cache, or None when it is disabled.
+
+    The "memory" backend keeps results in an in-process LRU, the "disk"
+    backend also writes them under `cfg.tool_cache_dir` so that they outlive
+    the process.
+    """
+    global _tool_cache
+    if not cfg.tool_cache_enabled:
+        return None
+    if _tool_cache is None:
+        with _tool_cache_lock:
+            if _tool_cache is None:
+                _tool_cache = CompletionCache(
+                    cache_dir=cfg.tool_cache_dir if cfg.tool_cache_backend == "disk" else "",
+                    max_memory_entries=cfg.tool_cache_max_memory_entries,
+                    max_disk_bytes=cfg.tool_cache_max_disk_bytes,
+                    ttl=None
+                )
+    return _tool_cache
+
+
+def get_tool_cache_stats(cfg=CFG):
+    cache = get_tool_cache(cfg)
+    return cache.get_stats() if cache is not None else dict()
+
+
+def dump_result(result):
+    """Make a json serializable cache entry of a tool result, None if it can not be serialized"""
+    entry = {
+        "result_class": f"{type(result).__module__}.{type(result).__name__}",
+        "json_data": result.json_data
+    }
+    try:
+        json.dumps(entry, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+    return entry
+
+
+def load_result(entry):
+    module_name, class_name = entry["result_class"].rsplit(".", 1)
+    result_class = getattr(importlib.import_module(module_name), class_name)
+    result = result_class(entry["json_data"])
+    result.cached = True
+    return result
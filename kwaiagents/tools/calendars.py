@@ -54,6 +54,7 @@ class CalendarTool(BaseTool):
     zh_name = "日历查询"
     description = 'Get calendar info:"get_calendar_info", args:"start_date":<str, "yyyy-MM-dd">, "end_date":<str, "yyyy-MM-dd">'
     tips = "get_calendar_info provide information on date, week day, solar term, zodiac, and holidays, but DO NOT provide the current time."
+    cache_ttl = None
 
     def __init__(
         self,
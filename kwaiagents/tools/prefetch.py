@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import threading
+import time
+import traceback
+
+from kwaiagents.config import CFG
+
+
+def normalize_url(url):
+    return url.strip().rstrip("/") if url else ""
+
+
+class PagePrefetcher(object):
+    """Fetches web pages in the background, before a tool asks for them.
+
+    After a `web_search` the top result pages are fetched on a bounded pool
+    while the agent plans its next step, `browse_website` then takes the
+    fetched page instead of loading it cold. At most `max_pages` pages are
+    kept, for `ttl` seconds, and the pages of a session that were never taken
+    are cancelled when the session ends. Takes are counted as hits or misses.
+    """
+    def __init__(self, max_workers=2, max_pages=16, ttl=300):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="page-prefetch")
+        self.max_pages = max_pages
+        self.ttl = ttl
+        # normalized url -> (future, scheduled time, session id)
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"scheduled": 0, "hits": 0, "misses": 0, "failed": 0, "cancelled": 0, "unused": 0}
+
+    def prefetch(self, urls, fetch, session_id=None):
+        """Start `fetch(url)` for the urls not fetched yet, its result is what `take` returns"""
+        with self._lock:
+            for url in urls:
+                key = normalize_url(url)
+                if not key or key in self._pages:
+                    continue
+                self._pages[key] = (self.executor.submit(fetch, url), time.time(), session_id)
+                self.stats["scheduled"] += 1
+            while len(self._pages) > self.max_pages:
+                _, (future, _, _) = self._pages.popitem(last=False)
+                self._discard(future)
+
+    def _discard(self, future):
+        # a fetch already running can not be stopped, its page is dropped when done
+        self.stats["cancelled" if future.cancel() else "unused"] += 1
+
+    def take(self, url, timeout=None):
+        """Return the prefetched page of `url`, or None on a miss.
+
+        A fetch still in flight is waited for at most `timeout` seconds.
+        """
+        with self._lock:
+            item = self._pages.pop(normalize_url(url), None)
+            if item is not None and time.time() - item[1] > self.ttl:
+                self._discard(item[0])
+                item = None
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+        try:
+            page = item[0].result(timeout=timeout)
+        except FutureTimeoutError:
+            page = None
+        except Exception:
+            print(traceback.format_exc())
+            page = None
+        with self._lock:
+            if page is None:
+                self.stats["failed"] += 1
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+        return page
+
+    def cancel_session(self, session_id):
+        """Drop the pages prefetched for `session_id` that were not taken"""
+        with self._lock:
+            for key in [key for key, (_, _, sid) in self._pages.items() if sid == session_id]:
+                future, _, _ = self._pages.pop(key)
+                self._discard(future)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending"] = len(self._pages)
+        takes = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / takes, 4) if takes else 0.0
+        return stats
+
+
+_page_prefetcher = None
+_page_prefetcher_lock = threading.Lock()
+
+
+def get_page_prefetcher(cfg=CFG):
+    """Return the process-wide page prefetcher, or None when `cfg.browse_prefetch` is off"""
+    global _page_prefetcher
+    if not cfg.browse_prefetch:
+        return None
+    if _page_prefetcher is None:
+        with _page_prefetcher_lock:
+            if _page_prefetcher is None:
+                _page_prefetcher = PagePrefetcher(
+                    max_workers=cfg.browse_prefetch_max_workers,
+                    max_pages=cfg.browse_prefetch_max_pages,
+                    ttl=cfg.browse_prefetch_ttl
+                )
+    return _page_prefetcher
+
+
+def get_page_prefetch_stats(cfg=CFG):
+    prefetcher = get_page_prefetcher(cfg)
+    return prefetcher.get_stats() if prefetcher is not None else dict()
@@ -0,0 +1,73 @@
+import threading
+
+
+class ThreadLocalTool(object):
+    """Stand-in for a stateful tool that builds one instance of the tool per thread"""
+    def __init__(self, tool_cls):
+        self.tool_cls = tool_cls
+        self._local = threading.local()
+
+    @property
+    def instance(self):
+        tool = getattr(self._local, "tool", None)
+        if tool is None:
+            tool = self.tool_cls()
+            self._local.tool = tool
+        return tool
+
+    def invoke(self, cfg=None, **kwargs):
+        return self.instance.invoke(cfg=cfg, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.tool_cls, name)
+
+
+class ToolRegistry(object):
+    """Process-wide tool instances, built once and shared by every session.
+
+    Tools are stateless singletons unless they set `thread_local`, those get
+    one instance per thread. Per-session state such as the chain logger is not
+    stored on the tools but passed to `BaseTool.invoke` as `cfg`.
+    """
+    def __init__(self, tool_classes, no_tool_classes):
+        self.tool_classes = list(tool_classes)
+        self.no_tool_classes = list(no_tool_classes)
+        self.name2cls = dict()
+        for tool_cls in self.tool_classes:
+            self.name2cls[tool_cls.name] = tool_cls
+            self.name2cls[tool_cls.zh_name] = tool_cls
+        self._tools = dict()
+        self._lock = threading.Lock()
+
+    def get(self, tool_cls):
+        tool = self._tools.get(tool_cls)
+        if tool is not None:
+            return tool
+        with self._lock:
+            tool = self._tools.get(tool_cls)
+            if tool is None:
+                tool = ThreadLocalTool(tool_cls) if tool_cls.thread_local else tool_cls()
+                self._tools[tool_cls] = tool
+        return tool
+
+    def resolve(self, tool_names):
+        """The tools an agent profile asks for, by name or zh_name, plus the no-op tools.
+
+        `auto` selects every tool, `notool` none at all.
+        """
+        if "notool" in tool_names:
+            return list()
+        if "auto" in tool_names:
+            tool_classes = self.tool_classes
+        elif isinstance(tool_names, str):
+            tool_classes = [tool_cls for tool_cls in self.tool_classes
+                if tool_cls.name in tool_names or tool_cls.zh_name in tool_names]
+        else:
+            tool_classes = list()
+            for name in tool_names:
+                tool_cls = self.name2cls.get(name)
+                if tool_cls is not None and tool_cls not in tool_classes:
+                    tool_classes.append(tool_cls)
+            tool_classes.sort(key=self.tool_classes.index)
+        return [self.get(tool_cls) for tool_cls in tool_classes + self.no_tool_classes]
+
@@ -7,7 +7,7 @@ from bs4 import BeautifulSoup as soup
 from duckduckgo_search import DDGS
 
 from kwaiagents.tools.base import BaseResult, BaseTool
-from kwaiagents.utils.selenium_utils import get_pagesource_with_selenium
+from kwaiagents.utils.selenium_utils import get_pagesource_with_selenium, get_page_load_timeout
 from kwaiagents.config import Config
 
 
@@ -52,6 +52,9 @@ class SearchTool(BaseTool):
     zh_name = "网页搜索"
     description = "Web Search:\"web_search\",args:\"text\":\"<search>\""
     tips = ""
+    cache_ttl = 3 * 3600
+    thread_local = True
+    uses_session_cfg = True
     
     def __init__(self, cfg=None, max_search_nums=5, lang="wt-wt", max_retry_times=5, *args, **kwargs):
         self.cfg = cfg if cfg else Config()
@@ -69,9 +72,10 @@ class SearchTool(BaseTool):
         else:
             self.driver = driver
             
-    def get_results_by_selenium(self, keyword):
+    def get_results_by_selenium(self, keyword, budget=None):
         url = f"https://duckduckgo.com/?q={keyword}&t=h_&ia=web"
-        driver, page_source = get_pagesource_with_selenium(url, "chrome", self.driver)
+        driver, page_source = get_pagesource_with_selenium(url, "chrome", self.driver,
+            timeout=get_page_load_timeout(self.cfg, budget))
         self.set_driver(driver)
         page_soup = soup(page_source, "html.parser")
         articles = page_soup.find_all("article")
@@ -100,7 +104,9 @@ class SearchTool(BaseTool):
                 search_results.append(r)
         return search_results
 
-    def _retry_search_result(self, keyword, counter=0):
+    def _retry_search_result(self, keyword, counter=0, budget=None):
+        if budget is not None:
+            budget.check()
         counter += 1
         if counter > self.max_retry_times:
             print("Search failed after %d retrying" % counter)
@@ -119,16 +125,16 @@ class SearchTool(BaseTool):
             if not search_results and counter >= 2:
                 use_selenium = True
             if use_selenium:
-                search_results = self.get_results_by_selenium(keyword)
+                search_results = self.get_results_by_selenium(keyword, budget)
             if search_results and ("Google Patents" in search_results[0]["body"] or "patent" in search_results[0]["href"]):
                 search_results = list()
             if not search_results:
-                return self._retry_search_result(keyword, counter)
+                return self._retry_search_result(keyword, counter, budget)
             return search_results
         except:
             print(traceback.format_exc())
             print("Retry search...")
-            return self._retry_search_result(keyword, counter)
+            return self._retry_search_result(keyword, counter, budget)
         
-    def __call__(self, text):
-        return SearchResult(self._retry_search_result(text))
\ No newline at end of file
+    def __call__(self, text, cfg=None):
+        return SearchResult(self._retry_search_result(text, budget=getattr(cfg, "session_budget", None)))
\ No newline at end of file
@@ -51,6 +51,7 @@ class SolarTermsTool(BaseTool):
     zh_name = "查询节气日期"
     description = 'Get solar terms info:"get_solar_terms_info", args:"year": <int, required>'
     tips = "get_solar_terms_info retrieve solar terms in Chinese for a given year."
+    cache_ttl = None
 
     def __init__(
         self,
@@ -35,6 +35,7 @@ class TimeDeltaTool(BaseTool):
     zh_name = "时间差工具"
     description = 'time delta:"time_delta", args:"start_time":<str, "yyyy-MM-dd HH:mm:ss">, "end_time":<str, "yyyy-MM-dd HH:mm:ss">'
     tips = "time_delta calculate the time interval between two timestamps."
+    cache_ttl = None
 
     def __init__(
         self,
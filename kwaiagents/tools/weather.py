@@ -78,6 +78,7 @@ class WeatherTool(BaseTool):
     zh_name = "查询天气"
     description = 'Get weather info:"get_weather_info", args:"location": <location1,location2,...,in English,required>, "start_date":"<str: yyyy-MM-dd, required>", "end_date":"<str: yyyy-MM-dd, required>", "is_current":"<str, yes or no, required>"'
     tips = ""
+    forecast_cache_ttl = 10 * 60
 
     location_c2e ={
         # 中国主要省市
@@ -455,7 +456,7 @@ class WeatherTool(BaseTool):
         "圣诞岛": "Kiritimati",
     }
 
-    location_e2c = {}
+    location_e2c = {name: key for key, value in location_c2e.items() for name in [value, value.lower()]}
 
 
     def __init__(
@@ -471,10 +472,6 @@ class WeatherTool(BaseTool):
         self.max_search_nums = max_search_nums
         self.max_retry_times = max_retry_times
         self.lang = lang
-        for key in self.location_c2e:
-            value = self.location_c2e[key]
-            self.location_e2c[value] = key
-            self.location_e2c[value.lower()] = key 
 
 
     def get_current_weather(self, location: str):
@@ -695,6 +692,20 @@ class WeatherTool(BaseTool):
         return final_dict
 
 
+    def get_cache_ttl(self, start_date="", end_date="", is_current="yes", *args, **kwargs):
+        """Weather of past days never changes, current weather and forecasts do"""
+        if is_current not in ["no", "否", "不是"]:
+            return self.forecast_cache_ttl
+        try:
+            if fix_date_to_format(end_date) < str(datetime.now())[:10]:
+                return None
+        except:
+            pass
+        return self.forecast_cache_ttl
+
+    def is_cacheable_result(self, result):
+        return bool(result.json_data) and result.json_data.get("查询结果") != "error"
+
     def __call__(self, start_date, end_date, is_current="yes", location="Beijing", *args, **kwargs):
         
         final_res = {
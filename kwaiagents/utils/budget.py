@@ -0,0 +1,95 @@
+import threading
+import time
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+class SessionBudget(object):
+    """Wall time, token, tool call and browse page limits of one session.
+
+    The planning loop, the tools and the LLM calls check the budget
+    cooperatively and raise `BudgetExceeded` once it is used up. The planning
+    loop then goes straight to the conclusion with the tasks done so far.
+    A limit of None means no limit.
+
+    Args:
+        timeout (float): Seconds from now until the deadline.
+        max_tokens (int): Prompt and completion tokens of all LLM calls.
+        max_tool_calls (int): Tool invocations.
+        max_browse_pages (int): Web pages loaded by `browse_website`.
+    """
+    def __init__(self, timeout=None, max_tokens=None, max_tool_calls=None, max_browse_pages=None):
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.max_tokens = max_tokens
+        self.max_tool_calls = max_tool_calls
+        self.max_browse_pages = max_browse_pages
+        self.tokens = 0
+        self.tool_calls = 0
+        self.browse_pages = 0
+        self.exceeded_reason = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(
+            timeout=cfg.session_timeout,
+            max_tokens=cfg.session_max_tokens,
+            max_tool_calls=cfg.session_max_tool_calls,
+            max_browse_pages=cfg.session_max_browse_pages
+        )
+
+    def remaining_time(self):
+        """Seconds left until the deadline, None without a deadline"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0.0)
+
+    def exhausted(self):
+        """Return why the session should conclude now, None while the budget lasts"""
+        if self.exceeded_reason is None:
+            if self.deadline is not None and time.time() >= self.deadline:
+                self.exceeded_reason = "deadline"
+            elif self.max_tokens is not None and self.tokens >= self.max_tokens:
+                self.exceeded_reason = "tokens"
+            elif self.max_tool_calls is not None and self.tool_calls >= self.max_tool_calls:
+                self.exceeded_reason = "tool_calls"
+        return self.exceeded_reason
+
+    def check(self):
+        """Raise once the deadline has passed or the tokens are spent"""
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise BudgetExceeded("Session budget exceeded: deadline")
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            raise BudgetExceeded("Session budget exceeded: tokens")
+
+    def add_tokens(self, tokens):
+        with self._lock:
+            self.tokens += tokens
+
+    def start_tool_call(self):
+        with self._lock:
+            self.check()
+            if self.max_tool_calls is not None and self.tool_calls >= self.max_tool_calls:
+                raise BudgetExceeded("Session budget exceeded: tool_calls")
+            self.tool_calls += 1
+
+    def start_browse_page(self):
+        with self._lock:
+            self.check()
+            if self.max_browse_pages is not None and self.browse_pages >= self.max_browse_pages:
+                raise BudgetExceeded("Session budget exceeded: browse_pages")
+            self.browse_pages += 1
+
+    def to_dict(self):
+        return {
+            "exceeded": self.exceeded_reason,
+            "remaining_time": round(self.remaining_time(), 3) if self.deadline is not None else None,
+            "tokens": self.tokens,
+            "max_tokens": self.max_tokens,
+            "tool_calls": self.tool_calls,
+            "max_tool_calls": self.max_tool_calls,
+            "browse_pages": self.browse_pages,
+            "max_browse_pages": self.max_browse_pages
+        }
@@ -1,5 +1,6 @@
 import json
 import sys
+import threading
 import time
 
 
@@ -74,6 +75,11 @@ logging_do_not_need_use_tool_msg = lambda lang: "我认为不需要使用工具"
 logging_do_not_need_use_tool_anymore_msg = lambda lang: "我认为不需要使用工具" if lang == "zh" else "I don't think I need to use tools anymore."
 logging_stop_thinking_msg = lambda lang: "对不起，我思考的步数有限，现在做个总结" if lang == "zh" else "Sorry, my thinking steps are limited, now let's make a conclusion."
 logging_finish_task_msg = lambda lang: "任务完成，得出结论" if lang == "zh" else "Task complete, let's make a conclusion."
+logging_budget_exceeded_msg = lambda lang: "对不起，本次会话的资源已用完，现在做个总结" if lang == "zh" else "Sorry, the budget of this session is used up, now let's make a conclusion."
+logging_tool_cache_hit_msg = lambda lang: "这个结果来自工具缓存" if lang == "zh" else "This result comes from the tool cache."
+logging_duplicate_command_reuse_msg = lambda lang: "这个命令已经执行过了，直接使用之前的结果" if lang == "zh" else "I have already executed this command, reusing its result."
+logging_duplicate_command_replan_msg = lambda lang: "这个命令已经执行过了，我重新思考" if lang == "zh" else "I have already executed this command, let me think again."
+logging_duplicate_command_conclude_msg = lambda lang: "我在重复执行命令，现在做个总结" if lang == "zh" else "I am repeating commands, now let's make a conclusion."
 
 class ChainMessageLogger(object):
     def __init__(self, output_streams=[sys.stdout], lang="en"):
@@ -83,6 +89,8 @@ class ChainMessageLogger(object):
         self.llm_prompt_responses = list()
         self.last_time = time.time()
         self.lang = lang
+        self.stream_texts = dict()
+        self._lock = threading.RLock()
 
     def __str__(self):
         s = "output stream list: {}".format([str(t) for t in self.output_streams])
@@ -101,6 +109,10 @@ class ChainMessageLogger(object):
         })
 
     def put(self, action: str, text: str = ""):
+        with self._lock:
+            self._put(action, text)
+
+    def _put(self, action: str, text: str = ""):
         text = str(text)
         chain_msg = {
             "index": len(self.chain_msgs),
@@ -132,6 +144,22 @@ class ChainMessageLogger(object):
             os.write(colored_chain_string)
         self.chain_msgs_str += chain_string
 
+    def put_stream(self, action: str, token: str):
+        """Write a partial text of `action` to the output streams as soon as it arrives"""
+        token = str(token)
+        self.stream_texts[action] = self.stream_texts.get(action, "") + token
+        for os in self.output_streams:
+            os.write(token)
+            if hasattr(os, "flush"):
+                os.flush()
+
+    def end_stream(self, action: str):
+        text = self.stream_texts.pop(action, "")
+        if text:
+            for os in self.output_streams:
+                os.write("\n")
+        return text
+
     def info(self, text: str):
         text = "{}".format(text)
         for os in self.output_streams:
@@ -142,4 +170,5 @@ class ChainMessageLogger(object):
         del self.llm_prompt_responses
         self.chain_msgs = list()
         self.chain_msgs_str = ""
-        self.llm_prompt_responses = list()
\ No newline at end of file
+        self.llm_prompt_responses = list()
+        self.stream_texts = dict()
\ No newline at end of file
@@ -84,19 +84,23 @@ def get_date_list(start_date, end_date):
     return date_list
 
 
-def get_current_time_and_date(lang="en"):
-    solar = Solar.fromDate(datetime.now())
+def get_current_time_and_date(lang="en", time_quantum=None):
+    """Describe the current time, rounded down to `time_quantum` seconds when it is given"""
+    now = datetime.now()
+    if time_quantum:
+        now = datetime.fromtimestamp(int(now.timestamp()) // time_quantum * time_quantum)
+    solar = Solar.fromDate(now)
     lunar = solar.getLunar()
     if lang == "zh":
         rst = f'''
-当前阳历日期和时间: {str(datetime.now())}
+当前阳历日期和时间: {str(now)}
 当前星期: 星期{str(solar.getWeekInChinese())}
 当前农历日期: {str(lunar.toString())}
 当前时辰: {str(lunar.getTimeZhi())}时
 '''.strip()
     else:
         rst = f'''
-Current Gregorian date and time: {str(datetime.now())}
+Current Gregorian date and time: {str(now)}
 Current day of the week: 星期{str(solar.getWeekInChinese())}
 Current lunar date: {str(lunar.toString())}
 Current Chinese time unit: {str(lunar.getTimeZhi())}时
@@ -0,0 +1,38 @@
+from collections import deque
+import math
+import threading
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of `values`, q in [0, 100]"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = min(max(math.ceil(q / 100.0 * len(values)) - 1, 0), len(values) - 1)
+    return values[rank]
+
+
+class LatencyRecorder(object):
+    """Latencies of the most recent `window` events and their percentiles"""
+    def __init__(self, window=1000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        with self._lock:
+            self.values.append(value)
+            self.count += 1
+
+    def summary(self, quantiles=(50, 90, 99)):
+        with self._lock:
+            values = list(self.values)
+            count = self.count
+        stats = {
+            "count": count,
+            "mean": round(sum(values) / len(values), 3) if values else 0.0,
+            "max": round(max(values), 3) if values else 0.0
+        }
+        for q in quantiles:
+            stats[f"p{q}"] = round(percentile(values, q), 3)
+        return stats
@@ -5,6 +5,7 @@ from typing import Generator, Optional, Dict
 from selenium.webdriver.remote.webdriver import WebDriver
 from kwaiagents.config import Config
 from kwaiagents.llms import create_chat_completion
+from kwaiagents.utils.budget import BudgetExceeded
 
 
 def split_sentences(text, lang='en'):
@@ -25,6 +26,41 @@ def split_sentences(text, lang='en'):
     return sentences
 
 
+def extract_terms(text: str):
+    """Lower-cased latin words and numbers, and single CJK characters"""
+    return re.findall(r"[a-z0-9]+|[\u4e00-\u9fff]", text.lower())
+
+
+def extractive_summary(text: str, query: str = "", max_length: int = 400) -> str:
+    """Keep the sentences of `text` sharing most terms with `query`, in their original order
+
+    Args:
+        text (str): The text to summarize
+        query (str): What the summary should be about
+        max_length (int): The maximum number of characters of the summary
+
+    Returns:
+        str: The summary, `text` itself if it is short enough
+    """
+    text = str(text)
+    if len(text) <= max_length:
+        return text
+    sentences = list()
+    for line in text.split("\n"):
+        sentences += [s.strip() for s in re.split(r"(?<=[.?!;])\s+|(?<=[。！？；])", line) if s.strip()]
+    query_terms = set(extract_terms(query))
+    scores = [len(query_terms & set(extract_terms(s))) for s in sentences]
+    picked, length = list(), 0
+    for idx in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)):
+        if length + len(sentences[idx]) + 1 > max_length:
+            continue
+        picked.append(idx)
+        length += len(sentences[idx]) + 1
+    if not picked:
+        return text[:max_length]
+    return "\n".join(sentences[idx] for idx in sorted(picked))
+
+
 def split_text(text: str, max_length: int = 4096) -> Generator[str, None, None]:
     """Split text into chunks of a maximum length
 
@@ -82,63 +118,43 @@ def summarize_text(
 
     prompt_responses = list()
 
-    if cfg.fast_llm_model in ["llama"] and len(chunks) > 1:
-        batch_size = 3
-        cnt = 0
-        for i in range(len(chunks) // batch_size + 1):
-            if driver:
-                scroll_to_percentage(driver, scroll_ratio * i)
-            batch_chunk = chunks[i * batch_size: (i + 1) * batch_size]
-            if not batch_chunk:
-                break
-            batch = [
-                create_message(chunk, question)
-                for chunk in batch_chunk
-            ]
+    batch_size = max(cfg.browse_summary_batch_size, 1)
+    budget = getattr(cfg, "session_budget", None)
+    out_of_budget = False
+    cnt = 0
+    for i in range(0, len(chunks), batch_size):
+        if driver:
+            scroll_to_percentage(driver, scroll_ratio * i)
+        batch = [
+            create_message(chunk, question)
+            for chunk in chunks[i: i + batch_size]
+        ]
+        try:
             batch_summaries, _ = create_chat_completion(
                     query=batch,
                     llm_model_name=cfg.fast_llm_model,
                     max_tokens=cfg.browse_summary_max_token,
+                    usage_tracker=cfg.usage_tracker,
+                    stage="auto_command_browse_website",
+                    generation_profile="chunk_summary",
+                    budget=budget,
                 )
-            if isinstance(batch_summaries, str):
-                batch_summaries = json.loads(batch_summaries)
-            summaries.extend(batch_summaries)
-
-            cnt += len(batch)
-            cfg.chain_logger.put("reading", f"{cnt} / {len(chunks)} 个段落")
-    else:
-        for i, chunk in enumerate(chunks):
-            if driver:
-                scroll_to_percentage(driver, scroll_ratio * i)
-            # print(f"Adding chunk {i + 1} / {len(chunks)} to memory")
-
-            # memory_to_add = f"Source: {url}\n" f"Raw content part#{i + 1}: {chunk}"
-
-            # MEMORY.add(memory_to_add)
-
-
-            cfg.chain_logger.put("reading", f"第 {i + 1} / {len(chunks)} 个段落")
-            message = create_message(chunk, question)
-
-            try:
-                summary, _ = create_chat_completion(
-                    query=message,
-                    llm_model_name=cfg.fast_llm_model,
-                    max_tokens=cfg.browse_summary_max_token,
-                )
-            except:
-                summary = ""
-            summaries.append(summary)
-            
-            prompt_responses.append((message, summary))
-        # print(f"Added chunk {i + 1} summary to memory")
-
-        # memory_to_add = f"Source: {url}\n" f"Content summary part#{i + 1}: {summary}"
-
-        # MEMORY.add(memory_to_add)
+        except BudgetExceeded:
+            # keep the chunks read so far
+            out_of_budget = True
+            break
+        except:
+            batch_summaries = [""] * len(batch)
+        summaries.extend(batch_summaries)
+        prompt_responses.extend(zip(batch, batch_summaries))
+
+        cnt += len(batch)
+        cfg.chain_logger.put("reading", f"{cnt} / {len(chunks)} 个段落")
     print(len(summaries))
+    if out_of_budget:
+        return "\n".join(summary for summary in summaries if summary), prompt_responses
     if len(summaries) == 1:
-        return summary, prompt_responses
+        return summaries[0], prompt_responses
     if len(summaries) == 0:
         return "", prompt_responses
     cfg.chain_logger.put("reading", f"总结这 {len(chunks)} 个段落")
@@ -151,6 +167,10 @@ def summarize_text(
             query=message,
             llm_model_name=cfg.fast_llm_model,
             max_tokens=cfg.browse_summary_max_token,
+            usage_tracker=cfg.usage_tracker,
+            stage="auto_command_browse_website",
+            generation_profile="reduce_summary",
+            budget=budget,
         )
     prompt_responses.append((message, summary))
 
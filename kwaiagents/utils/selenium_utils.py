@@ -46,18 +46,34 @@ def get_web_driver(selenium_web_browser):
     return current_driver
 
 
-def get_pagesource_with_selenium(url: str, selenium_web_browser:str, driver: WebDriver = None) -> str:
+def get_page_load_timeout(cfg, budget=None):
+    """The page load timeout of the config, shortened to the time left in the session budget"""
+    timeout = cfg.selenium_page_load_timeout if cfg else None
+    remaining = budget.remaining_time() if budget is not None else None
+    if remaining is not None:
+        timeout = min(timeout, remaining) if timeout is not None else remaining
+    return timeout
+
+
+def get_pagesource_with_selenium(url: str, selenium_web_browser:str, driver: WebDriver = None, timeout: float = None) -> str:
     logging.getLogger("selenium").setLevel(logging.CRITICAL)
     driver = get_web_driver(selenium_web_browser)
     if driver is None:
         driver = get_web_driver(selenium_web_browser)
-    
-    driver.get(url)
+    try:
+        if timeout is not None:
+            driver.set_page_load_timeout(max(timeout, 1))
 
-    WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.TAG_NAME, "body"))
-    )
+        driver.get(url)
+
+        WebDriverWait(driver, min(10, max(timeout, 1)) if timeout is not None else 10).until(
+            EC.presence_of_element_located((By.TAG_NAME, "body"))
+        )
 
-    # Get the HTML content directly from the browser's DOM
-    page_source = driver.execute_script("return document.body.outerHTML;")
+        # Get the HTML content directly from the browser's DOM
+        page_source = driver.execute_script("return document.body.outerHTML;")
+    except:
+        # the caller only gets the driver back on success, so a failed load closes it
+        driver.quit()
+        raise
     return driver, page_source
\ No newline at end of file
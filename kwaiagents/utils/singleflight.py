@@ -0,0 +1,72 @@
+import threading
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls that share a key into one in-flight call.
+
+    The first caller of a key runs the function, callers arriving while it is
+    running wait for its result instead of running it again. Errors are
+    raised in every waiter, except the `rerun_errors` that are about the
+    leader's own call, e.g. its session budget, after which each waiter runs
+    `fn` itself.
+    """
+    def __init__(self):
+        self._flights = dict()
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key, fn, timeout=None, rerun_errors=()):
+        """Run `fn` once for all concurrent callers of `key`.
+
+        Args:
+            key: Hashable key of the call.
+            fn: Function without arguments.
+            timeout (float): Seconds a waiter waits for the in-flight call, None for no limit.
+            rerun_errors (tuple): Exception types of the leader after which a waiter runs `fn` itself.
+
+        Returns:
+            tuple: The result of `fn` and whether this caller ran it.
+
+        Raises:
+            TimeoutError: If the in-flight call did not finish within `timeout`.
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                flight.waiters += 1
+                self.stats["coalesced"] += 1
+
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as err:
+                flight.error = err
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.done.set()
+        elif not flight.done.wait(timeout):
+            raise TimeoutError(f"Timed out after {timeout}s waiting for in-flight call {key}")
+
+        if flight.error is not None:
+            if not leader and isinstance(flight.error, rerun_errors):
+                return fn(), True
+            raise flight.error
+        return flight.result, leader
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
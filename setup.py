@@ -21,7 +21,9 @@ setup(
     long_description_content_type='text/markdown',
     entry_points = {
         'console_scripts': [
-            'kagentsys=kwaiagents.agent_start:main']
+            'kagentsys=kwaiagents.agent_start:main',
+            'kagentsys-server=kwaiagents.agent_server:main',
+            'kagentsys-batch=kwaiagents.agent_batch:main']
     },
     packages=find_packages(),
     license='Attribution-NonCommercial-ShareAlike 4.0',
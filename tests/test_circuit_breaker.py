@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+import kwaiagents.llms as llms
+from kwaiagents.config import CFG, session_config
+from kwaiagents.llms.retry import RetryPolicy, CircuitOpenError, get_circuit_breaker
+
+
+class FakeClient(object):
+    default_temperature = 0.1
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.outcomes = list()
+
+    def next_outcome(self, query):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome, [[query, outcome]]
+
+    def chat(self, query, *args, **kwargs):
+        return self.next_outcome(query)
+
+    async def achat(self, query, *args, **kwargs):
+        outcome = self.outcomes[0]
+        if outcome == "hang":
+            self.outcomes.pop(0)
+            await asyncio.sleep(10)
+        return self.next_outcome(query)
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+@pytest.fixture
+def client(monkeypatch, request):
+    client = FakeClient(f"fake:{request.node.name}")
+    monkeypatch.setattr(llms, "get_llm_client", lambda *args, **kwargs: client)
+    cfg = CFG.copy()
+    cfg.llm_singleflight = False
+    cfg.llm_breaker_failure_threshold = 1
+    cfg.llm_breaker_reset_timeout = 0.05
+    with session_config(cfg):
+        yield client
+
+
+def complete(query="hi"):
+    return llms.create_chat_completion(query, retry_policy=RetryPolicy(max_retries=1, base_delay=0))
+
+
+def open_breaker(client):
+    client.outcomes.append(ConnectionError("down"))
+    with pytest.raises(RuntimeError):
+        complete()
+    assert get_circuit_breaker(client.endpoint).state == "open"
+    time.sleep(0.1)
+
+
+def test_half_open_trial_released_on_fatal_error(client):
+    open_breaker(client)
+    client.outcomes.append(http_error(400))
+    with pytest.raises(requests.HTTPError):
+        complete()
+    # the endpoint recovered, the next call is the new trial and closes the breaker
+    client.outcomes.extend(["ok", "ok"])
+    assert complete()[0] == "ok"
+    assert complete()[0] == "ok"
+    assert get_circuit_breaker(client.endpoint).state == "closed"
+
+
+def test_half_open_trial_released_on_cancel(client):
+    open_breaker(client)
+    client.outcomes.append("hang")
+
+    async def cancel_trial():
+        task = asyncio.ensure_future(llms.acreate_chat_completion(
+            "hi", retry_policy=RetryPolicy(max_retries=1, base_delay=0)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    client.outcomes.append("ok")
+    assert complete()[0] == "ok"
+
+
+def test_half_open_rejects_concurrent_trial(client):
+    open_breaker(client)
+    breaker = get_circuit_breaker(client.endpoint)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.release_trial()
+    breaker.before_call()
+
+
+def test_pooled_workers_are_left_to_the_pool(client):
+    # failures of a pooled worker count against that worker in its pool, not against the whole pool
+    client.pool = object()
+    client.outcomes.extend([ConnectionError("one bad worker")] * 3 + ["ok"])
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            complete()
+    assert complete()[0] == "ok"
+    assert get_circuit_breaker(client.endpoint).state == "closed"
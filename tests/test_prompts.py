@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from kwaiagents.agents import AgentProfile
+from kwaiagents.agents.memory import MemoryBuilder
+from kwaiagents.agents.prompts import make_planning_prompt, count_shared_prefix_tokens
+from kwaiagents.tools import TOOLS
+import kwaiagents.utils.date_utils as date_utils
+
+
+class CharTokenizer(object):
+    def encode(self, text, add_special_tokens=False):
+        return [ord(c) for c in text]
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return "".join(chr(t) for t in tokens)
+
+
+class Clock(datetime):
+    current = datetime(2024, 3, 1, 10, 0, 0, 123456)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+def make_task(task_id):
+    return {
+        "task_id": task_id,
+        "task_name": f"step {task_id}",
+        "command": {"name": "web_search", "args": {"text": f"query {task_id}"}},
+        "result": f"Result {task_id}: " + "text found on the web. " * 20
+    }
+
+
+def shared_prefix_ratio(prompt_layout):
+    """Shared prefix tokens of two consecutive planning calls, over the tokens of the second"""
+    tokenizer = CharTokenizer()
+    agent_profile = AgentProfile({"lang": "en"})
+    tools = TOOLS.resolve(agent_profile.tools)
+    builder = MemoryBuilder(tokenizer=tokenizer)
+    tasks = [make_task(1)]
+    prompts = list()
+    Clock.current = datetime(2024, 3, 1, 10, 0, 0, 123456)
+    for _ in range(2):
+        memory = builder.build(list(), tasks, "goal")
+        prompts.append(make_planning_prompt(agent_profile, "goal", tools, memory, 4096, tokenizer,
+            prompt_layout=prompt_layout, time_quantum=60 if prompt_layout == "prefix_cache" else None))
+        tasks = tasks + [make_task(len(tasks) + 1)]
+        Clock.current += timedelta(seconds=5)
+    return count_shared_prefix_tokens(tokenizer, *prompts) / len(tokenizer.encode(prompts[1]))
+
+
+def test_prefix_cache_layout_shares_the_planning_prefix(monkeypatch):
+    monkeypatch.setattr(date_utils, "datetime", Clock)
+    default_ratio = shared_prefix_ratio("default")
+    prefix_cache_ratio = shared_prefix_ratio("prefix_cache")
+    # everything up to the memory, and the memory of the first call, is shared
+    assert prefix_cache_ratio > 0.8
+    assert prefix_cache_ratio > default_ratio + 0.2
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from kwaiagents.config import CFG
+from kwaiagents.tools.base import BaseTool, BaseResult
+from kwaiagents.utils.budget import BudgetExceeded, SessionBudget
+from kwaiagents.utils.singleflight import SingleFlight
+
+
+def run_concurrently(*fns):
+    results = [None] * len(fns)
+
+    def run(idx, fn):
+        try:
+            results[idx] = fn()
+        except Exception as err:
+            results[idx] = err
+
+    threads = [threading.Thread(target=run, args=(idx, fn)) for idx, fn in enumerate(fns)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_waiter_reruns_after_leader_budget_error():
+    flights = SingleFlight()
+    calls = list()
+
+    def leader():
+        calls.append("leader")
+        time.sleep(0.1)
+        raise BudgetExceeded("Session budget exceeded: tokens")
+
+    def waiter():
+        calls.append("waiter")
+        return "ok"
+
+    results = run_concurrently(
+        lambda: flights.do("key", leader, rerun_errors=(BudgetExceeded,)),
+        lambda: flights.do("key", waiter, rerun_errors=(BudgetExceeded,)))
+    assert isinstance(results[0], BudgetExceeded)
+    assert results[1] == ("ok", True)
+    assert calls == ["leader", "waiter"]
+
+
+def test_waiter_shares_leader_error():
+    flights = SingleFlight()
+
+    def leader():
+        time.sleep(0.1)
+        raise ValueError("bad")
+
+    results = run_concurrently(
+        lambda: flights.do("key", leader, rerun_errors=(BudgetExceeded,)),
+        lambda: flights.do("key", lambda: "unused", rerun_errors=(BudgetExceeded,)))
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+class PageTool(BaseTool):
+    name = "test_page_tool"
+    uses_session_cfg = True
+
+    def __call__(self, url, cfg=None):
+        cfg.session_budget.start_browse_page()
+        time.sleep(0.1)
+        return BaseResult({"url": url})
+
+
+def session_cfg(max_browse_pages):
+    cfg = CFG.copy()
+    cfg.set_session_budget(SessionBudget(max_browse_pages=max_browse_pages))
+    return cfg
+
+
+def test_session_cfg_tools_are_not_shared_across_sessions():
+    tool = PageTool()
+    limited, unlimited = session_cfg(0), session_cfg(None)
+    results = run_concurrently(
+        lambda: tool.invoke(cfg=limited, url="http://example.com"),
+        lambda: tool.invoke(cfg=unlimited, url="http://example.com"))
+    assert isinstance(results[0], BudgetExceeded)
+    assert results[1].json_data == {"url": "http://example.com"}
+    assert unlimited.session_budget.browse_pages == 1
@@ -0,0 +1,33 @@
+import kwaiagents.llms as llms
+from kwaiagents.config import CFG, session_config
+from kwaiagents.llms.clients import consume_stream
+from kwaiagents.llms.usage import UsageTracker
+
+
+class CharTokenizer(object):
+    def encode(self, text, add_special_tokens=False):
+        return list(text)
+
+
+class StreamClient(object):
+    endpoint = "fake:stream"
+    default_temperature = 0.1
+
+    def chat(self, query, history=list(), stream_callback=None, *args, **kwargs):
+        # like the real clients, a stream reports no usage
+        return consume_stream(iter(["ab", "cd"]), query, history, stream_callback)
+
+
+def test_streamed_usage_is_estimated(monkeypatch):
+    monkeypatch.setattr(llms, "get_llm_client", lambda *args, **kwargs: StreamClient())
+    tracker = UsageTracker()
+    tokens = list()
+    with session_config(CFG.copy()):
+        response, _ = llms.create_chat_completion(
+            "prompt", stream_callback=tokens.append, usage_tracker=tracker, stage="auto_conclusion",
+            tokenizer=CharTokenizer())
+    assert response == "abcd" and tokens == ["ab", "cd"]
+    usage = tracker.to_dict()["stages"]["auto_conclusion"]
+    assert usage["prompt_tokens"] == len("prompt")
+    assert usage["completion_tokens"] == 4
+    assert usage["estimated_calls"] == 1